@@ -0,0 +1,183 @@
+# Streaming loader of company files, for markets of any size.
+import csv
+import hashlib
+import json
+import os
+import random
+import time
+from .common import db, logger
+
+
+class CompanyLoader:
+    # Words and suffixes the names of unnamed companies are made of
+    names_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "text-files", "company-names.json")
+    # Accepted column names of the CSV files and keys of the JSON objects
+    aliases = {
+        'symbol': 'symbol', 'company_symbol': 'symbol', 'ticker': 'symbol',
+        'name': 'name', 'company_name': 'name',
+        'value': 'value', 'current_stock_value': 'value', 'price': 'value',
+        'change': 'change', 'changes': 'change',
+    }
+    # Bytes read from a JSON file at a time
+    read_size = 1 << 16
+
+    # Constructor
+    def __init__(self, chunk_size = 1000):
+        """
+        Class CompanyLoader reads companies from CSV or JSON files without
+        holding the file in memory, and loads them into the company table
+        chunk_size rows per bulk insert, all in one DB transaction.
+        CSV files have a header row naming the symbol, name, value and
+        change columns. JSON files hold either a list of objects with a
+        symbol, or an object mapping symbols to objects, like
+        preset_companies. Only the symbol is required: a missing name,
+        value or change is generated from the symbol, so the same file
+        always gives the same market. Later rows with an already read
+        symbol are skipped.
+        """
+        self.chunk_size = chunk_size
+        self.words = None
+        self.suffixes = None
+
+    ############
+    # Methods
+    ############
+
+    def read(self, path):
+        """
+        Generator of the (symbol, company) pairs of a .csv or .json file,
+        company being a dictionary with name, value and change like the
+        ones of preset_companies.
+        """
+        records = self.read_csv(path) if path.lower().endswith('.csv') else self.read_json(path)
+        seen = set()
+        for record in records:
+            record = {self.aliases[k.strip().lower()]: v for k, v in record.items()
+                      if k and k.strip().lower() in self.aliases}
+            symbol = str(record.get('symbol') or '').strip()
+            if not symbol:
+                raise ValueError(f'Company without a symbol in {path}: {record}')
+            if symbol in seen:
+                continue
+            seen.add(symbol)
+            yield symbol, self.complete(symbol, record)
+
+    def read_csv(self, path):
+        with open(path, newline='', encoding='utf-8') as f:
+            yield from csv.DictReader(f)
+
+    def read_json(self, path):
+        """
+        Generator of the company objects of a JSON file, decoded one at a
+        time from a buffer refilled read_size bytes at a time.
+        """
+        decoder = json.JSONDecoder()
+        with open(path, encoding='utf-8') as f:
+            buffer, pos = f.read(self.read_size), 0
+
+            # Returns the position of the next non blank character,
+            # reading more of the file if needed, None at the end
+            def skip(chars = ' \t\r\n'):
+                nonlocal buffer, pos
+                while True:
+                    while pos < len(buffer) and buffer[pos] in chars:
+                        pos += 1
+                    if pos < len(buffer):
+                        return pos
+                    more = f.read(self.read_size)
+                    if not more:
+                        return None
+                    buffer, pos = more, 0
+
+            # Decodes the next JSON value
+            def decode():
+                nonlocal buffer, pos
+                while True:
+                    try:
+                        value, end = decoder.raw_decode(buffer, pos)
+                        # A number may go on in the next block
+                        if end < len(buffer) or not isinstance(value, (int, float)):
+                            pos = end
+                            return value
+                    except json.JSONDecodeError:
+                        pass
+                    more = f.read(self.read_size)
+                    if not more:
+                        value, pos = decoder.raw_decode(buffer, pos)
+                        return value
+                    buffer = buffer[pos:] + more
+                    pos = 0
+
+            if skip() is None or buffer[pos] not in '[{':
+                raise ValueError(f'{path} does not hold a JSON list or object')
+            mapping = buffer[pos] == '{'
+            pos += 1
+            while True:
+                if skip(' \t\r\n,') is None:
+                    raise ValueError(f'{path} ends before its JSON list or object')
+                if buffer[pos] in ']}':
+                    return
+                if not mapping:
+                    yield decode()
+                    continue
+                symbol = decode()
+                if skip() is None or buffer[pos] != ':':
+                    raise ValueError(f'Expected ":" after "{symbol}" in {path}')
+                pos += 1
+                skip()
+                company = decode()
+                yield dict(company, symbol=symbol)
+
+    def complete(self, symbol, record):
+        """
+        Returns the company of a record, with the missing name, value and
+        change generated from a random generator seeded by the symbol.
+        """
+        rng = random.Random(hashlib.sha256(symbol.encode()).digest())
+        value = record.get('value')
+        change = record.get('change')
+        return dict(
+            name = str(record.get('name') or '').strip() or self.generate_name(rng),
+            value = float(value) if value not in (None, '') else round(rng.uniform(5, 500), 2),
+            change = float(change) if change not in (None, '') else round(rng.uniform(-2, 2), 2),
+        )
+
+    def generate_name(self, rng):
+        if self.words is None:
+            with open(self.names_file) as f:
+                names = json.load(f)
+            self.words = names['name_string'].split()
+            self.suffixes = names['suffixes']
+        return ' '.join(rng.sample(self.words, 2) + [rng.choice(self.suffixes)]).strip()
+
+    def load(self, simulator, path):
+        """
+        Replace the companies with the ones of the file, like
+        initialize_database (so deleting every transaction, holding and
+        limit order), in one DB transaction. Returns the number of rows,
+        the seconds taken and the rows per second.
+        """
+        start = time.perf_counter()
+        rows = 0
+        try:
+            db.stock_history.truncate()
+            db.company.truncate()
+            chunk = []
+            for symbol, company in self.read(path):
+                chunk.append(simulator.company_fields(symbol, company))
+                if len(chunk) == self.chunk_size:
+                    db.company.bulk_insert(chunk)
+                    rows += len(chunk)
+                    chunk = []
+            db.company.bulk_insert(chunk)
+            rows += len(chunk)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        seconds = time.perf_counter() - start
+        simulator.companies_changed()
+        stats = dict(rows=rows, seconds=round(seconds, 3),
+                     rows_per_second=round(rows / seconds) if seconds else None)
+        logger.info(f'Loaded {rows} companies from {path} in {seconds:.2f}s ({stats["rows_per_second"]} rows/s)')
+        return stats
@@ -0,0 +1,136 @@
+# Process-local registry of the company table.
+import threading
+import numpy as np
+from .common import db
+
+
+class RegistryState:
+    """
+    The company table at one version, as parallel arrays with O(1) lookup
+    by company id and by symbol. A state is never modified once built:
+    reloading the table builds a new one, so a reader holding a state sees
+    arrays, maps and version that all belong together.
+    """
+    __slots__ = ('version', 'ids', 'values', 'changes', 'names', 'symbols',
+                 'latest_updates', 'by_id', 'by_symbol')
+
+    def __init__(self, rows = (), version = 0):
+        self.version = version
+        self.ids = np.array([r.id for r in rows], dtype=np.int64)
+        self.values = np.array([r.current_stock_value for r in rows], dtype=float)
+        self.changes = np.array([r.changes for r in rows], dtype=float)
+        self.names = [r.company_name for r in rows]
+        self.symbols = [r.company_symbol for r in rows]
+        self.latest_updates = [r.latest_update for r in rows]
+        self.by_id = {int(r.id): i for i, r in enumerate(rows)}
+        self.by_symbol = {r.company_symbol: i for i, r in enumerate(rows)}
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def index(self, key):
+        """
+        Return the position of the company in the arrays, where key
+        is either a company id (int) or a symbol (str).
+        Returns None for unknown companies.
+        """
+        if isinstance(key, (int, np.integer)):
+            return self.by_id.get(int(key))
+        return self.by_symbol.get(key)
+
+    def record(self, i):
+        """
+        Return the company at position i as a dictionary shaped like a
+        row of the company table.
+        """
+        return {
+            'id': int(self.ids[i]),
+            'company_name': self.names[i],
+            'company_symbol': self.symbols[i],
+            'current_stock_value': float(self.values[i]),
+            'changes': float(self.changes[i]),
+            'latest_update': self.latest_updates[i],
+        }
+
+
+class CompanyRegistry:
+
+    # Constructor
+    def __init__(self):
+        """
+        Class CompanyRegistry keeps the company table in memory as a
+        RegistryState. The table is read on first use and again after
+        invalidate(), which must be called whenever the company table is
+        rewritten; the new state replaces the old one in one assignment.
+        Code using more than one lookup or array should take the state
+        once with current() and use it throughout.
+        The registry is local to the process.
+        """
+        self.lock = threading.Lock()
+        self.state = None
+        # Bumped on every invalidate so that callers can tell the
+        # company universe has changed, given to the next state.
+        self.next_version = 1
+
+    ############
+    # Methods
+    ############
+
+    def invalidate(self):
+        """
+        Drop the cached table, it is read again on next use.
+        """
+        with self.lock:
+            self.state = None
+            self.next_version += 1
+
+    def current(self):
+        """
+        Return the RegistryState of the company table, reading the table
+        if needed.
+        """
+        state = self.state
+        if state is not None:
+            return state
+        with self.lock:
+            if self.state is None:
+                rows = db(db.company).select(orderby=db.company.id)
+                self.state = RegistryState(rows, self.next_version)
+            return self.state
+
+    def ensure_loaded(self):
+        """
+        Read the company table if needed, returns its RegistryState.
+        """
+        return self.current()
+
+    @property
+    def version(self):
+        return self.current().version
+
+    def __len__(self):
+        return len(self.current())
+
+    def index(self, key):
+        """
+        Return the position of the company in the current arrays, where
+        key is either a company id (int) or a symbol (str).
+        Returns None for unknown companies.
+        """
+        return self.current().index(key)
+
+    def get(self, key):
+        """
+        Return the company for the given id or symbol as a dictionary,
+        or None if it does not exist.
+        """
+        state = self.current()
+        i = state.index(key)
+        return None if i is None else state.record(i)
+
+    def first(self):
+        """
+        Return the company with the lowest id, or None if there are none.
+        """
+        state = self.current()
+        return state.record(0) if len(state) else None
@@ -0,0 +1,168 @@
+# Net worth ranking of every user.
+import threading
+import time
+import numpy as np
+from .common import db
+
+
+class Leaderboard:
+
+    # Constructor
+    def __init__(self, simulator, size = 1000, rebuild_interval = 300.0):
+        """
+        Class Leaderboard ranks the users by net worth, their balance plus
+        the value of their shares at the current prices, and keeps the
+        size best. The balances and open positions of every user are read
+        in one go and kept in memory as parallel arrays: the positions are
+        the non zero entries of the (users x companies) shares matrix, so
+        valuing every user at a tick is one sparse matrix-vector product
+        with the snapshot prices (a bincount). Executed orders update the
+        arrays in place through update, so the ranking follows the trades
+        without reading the tables again. The arrays are read again after
+        invalidate, when the companies are reseeded and every
+        rebuild_interval seconds, which picks up new users.
+        The ranking is computed at most once per tick and per change.
+        """
+        self.simulator = simulator
+        self.size = size
+        self.rebuild_interval = rebuild_interval
+        self.lock = threading.Lock()
+        self.built = None
+        self.version = None
+        # Users: auth_user id, display name and balance, by row
+        self.user_ids = np.empty(0, dtype=np.int64)
+        self.names = []
+        self.balances = np.empty(0)
+        self.user_index = {}
+        # Positions: user row, company id, registry position and shares
+        self.position_users = np.empty(0, dtype=np.int64)
+        self.position_companies = np.empty(0, dtype=np.int64)
+        self.position_idx = np.empty(0, dtype=np.int64)
+        self.position_shares = np.empty(0)
+        self.position_index = {}
+        # Positions opened since the arrays were built
+        self.new_positions = []
+        # Bumped on every update, part of the key of the ranking
+        self.generation = 0
+        self.ranking = None
+        self.ranking_key = None
+
+    ############
+    # Methods
+    ############
+
+    def invalidate(self):
+        """
+        Read the users and holdings again on next use, to be called after
+        the holding or user tables are rewritten.
+        """
+        with self.lock:
+            self.built = None
+
+    def ensure_built(self):
+        state = self.simulator.registry.current()
+        if self.is_current(state):
+            return
+        with self.lock:
+            # Another thread may have built it while this one waited
+            if not self.is_current(state):
+                self.build(state)
+
+    def is_current(self, state):
+        return (self.built is not None and self.version == state.version
+                and time.monotonic() - self.built < self.rebuild_interval)
+
+    def build(self, state):
+        # Caller holds the lock
+        version = state.version
+        users = db(db.user.user_id == db.auth_user.id).select(
+            db.user.user_id, db.user.user_balance, db.auth_user.first_name, db.auth_user.last_name,
+            orderby=db.user.user_id)
+        positions = db(db.holding.shares > 0).select(
+            db.holding.user_id, db.holding.company_id, db.holding.shares)
+        self.user_ids = np.array([r.user.user_id for r in users], dtype=np.int64)
+        self.names = [f'{r.auth_user.first_name or ""} {r.auth_user.last_name or ""}'.strip() for r in users]
+        self.balances = np.array([r.user.user_balance or 0.0 for r in users], dtype=float)
+        self.user_index = {int(u): i for i, u in enumerate(self.user_ids)}
+        kept = [r for r in positions if r.user_id in self.user_index]
+        self.position_users = np.array([self.user_index[r.user_id] for r in kept], dtype=np.int64)
+        self.position_companies = np.array([r.company_id for r in kept], dtype=np.int64)
+        self.position_shares = np.array([r.shares for r in kept], dtype=float)
+        self.position_index = {(r.user_id, r.company_id): k for k, r in enumerate(kept)}
+        self.position_idx = self.registry_positions(state, self.position_companies)
+        self.new_positions = []
+        self.version = version
+        self.built = time.monotonic()
+        self.generation += 1
+
+    def registry_positions(self, state, company_ids):
+        return np.array([state.by_id.get(int(c), -1) for c in company_ids], dtype=np.int64)
+
+    def update(self, user_id, company_id, shares, balance):
+        """
+        Apply an executed order: the user now has shares of the company
+        and the given balance. Orders of users the arrays do not have yet
+        are left to the next rebuild.
+        """
+        with self.lock:
+            u = self.user_index.get(user_id)
+            if self.built is None or u is None:
+                return
+            self.balances[u] = balance
+            k = self.position_index.get((user_id, company_id))
+            if k is None:
+                k = len(self.position_shares) + len(self.new_positions)
+                self.position_index[(user_id, company_id)] = k
+                self.new_positions.append((u, company_id, shares))
+            elif k < len(self.position_shares):
+                self.position_shares[k] = shares
+            else:
+                self.new_positions[k - len(self.position_shares)] = (u, company_id, shares)
+            self.generation += 1
+
+    def merge_new_positions(self, state):
+        # Caller holds the lock
+        if not self.new_positions:
+            return
+        users, companies, shares = zip(*self.new_positions)
+        self.position_users = np.concatenate((self.position_users, np.array(users, dtype=np.int64)))
+        self.position_companies = np.concatenate((self.position_companies, np.array(companies, dtype=np.int64)))
+        self.position_idx = np.concatenate((self.position_idx, self.registry_positions(state, companies)))
+        self.position_shares = np.concatenate((self.position_shares, np.array(shares, dtype=float)))
+        self.new_positions = []
+
+    def rank(self):
+        """
+        Returns the ranking at the current tick, a list of at most size
+        (user id, name, net worth), best first, ties by user id.
+        """
+        self.ensure_built()
+        quotes = self.simulator.snapshot()
+        key = (quotes.time, quotes.version, self.generation)
+        if self.ranking_key == key:
+            return self.ranking
+        with self.lock:
+            if quotes.version != self.version:
+                return []
+            self.merge_new_positions(quotes.companies)
+            priced = self.position_idx >= 0
+            values = self.position_shares[priced] * quotes.prices[self.position_idx[priced]]
+            net = self.balances + np.bincount(self.position_users[priced], weights=values,
+                                              minlength=len(self.balances))
+            n = min(self.size, len(net))
+            top = np.argpartition(-net, n - 1)[:n] if 0 < n < len(net) else np.arange(len(net))
+            top = top[np.lexsort((self.user_ids[top], -net[top]))]
+            ranking = [(int(self.user_ids[u]), self.names[u], float(net[u])) for u in top]
+            self.ranking, self.ranking_key = ranking, (quotes.time, quotes.version, self.generation)
+        return ranking
+
+    def page(self, page, size):
+        """
+        Returns one page of the ranking as rows with the rank, user id,
+        name and net worth, and the number of ranked users.
+        """
+        ranking = self.rank()
+        start = page * size
+        rows = [dict(rank=start + i + 1, user_id=user_id, name=name, net_worth=round(net, 2))
+                for i, (user_id, name, net) in enumerate(ranking[start:start + size])]
+        return dict(rows=rows, page=page, size=size, total=len(ranking))
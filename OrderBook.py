@@ -0,0 +1,211 @@
+# Limit order books of the companies and the engine filling them.
+import heapq
+import itertools
+import threading
+import time
+from .common import db
+from .OrderQueue import Order, OrderQueue
+
+
+class OrderBook:
+
+    # Constructor
+    def __init__(self):
+        """
+        Class OrderBook holds the open limit orders of one company in two
+        heaps with price-time priority: bids by highest limit price then
+        oldest, asks by lowest limit price then oldest. Adding an order is
+        O(log n). Cancelled orders are only dropped from the orders map
+        and skipped when they reach the top of a heap; the heaps are
+        rebuilt when more than half of their entries are stale.
+        """
+        self.lock = threading.Lock()
+        self.bids = []   # (-limit_price, seq, order_id)
+        self.asks = []   # (limit_price, seq, order_id)
+        # order_id -> (user_id, side, count, limit_price, seq) of the open orders
+        self.orders = {}
+        self.seq = itertools.count()
+
+    ############
+    # Methods
+    ############
+
+    def __len__(self):
+        return len(self.orders)
+
+    def add(self, order_id, user_id, side, count, limit_price, seq = None):
+        """
+        Add an open order behind the ones at the same price, or at its
+        former place when given the seq it was taken out with.
+        """
+        with self.lock:
+            if seq is None:
+                seq = next(self.seq)
+            self.orders[order_id] = (user_id, side, count, limit_price, seq)
+            if side == 'buy':
+                heapq.heappush(self.bids, (-limit_price, seq, order_id))
+            else:
+                heapq.heappush(self.asks, (limit_price, seq, order_id))
+
+    def cancel(self, order_id):
+        """
+        Remove an open order, returns False if it is not in the book
+        (unknown, already cancelled or taken by fills).
+        """
+        with self.lock:
+            if self.orders.pop(order_id, None) is None:
+                return False
+            if len(self.bids) + len(self.asks) > 2 * len(self.orders) + 64:
+                self.bids = [e for e in self.bids if e[2] in self.orders]
+                self.asks = [e for e in self.asks if e[2] in self.orders]
+                heapq.heapify(self.bids)
+                heapq.heapify(self.asks)
+            return True
+
+    def fills(self, price):
+        """
+        Take out of the book every order the price reaches, bids with a
+        limit at or above it and asks with a limit at or below it, in
+        priority order. Returns them as (order_id, user_id, side, count,
+        limit_price, seq).
+        Only the matching orders and the stale entries above them are
+        visited.
+        """
+        taken = []
+        with self.lock:
+            for heap, reached in ((self.bids, lambda e: -e[0] >= price),
+                                  (self.asks, lambda e: e[0] <= price)):
+                while heap and (heap[0][2] not in self.orders or reached(heap[0])):
+                    order_id = heapq.heappop(heap)[2]
+                    order = self.orders.pop(order_id, None)
+                    if order is not None:
+                        taken.append((order_id,) + order)
+        return taken
+
+
+class MatchingEngine:
+
+    # Constructor
+    def __init__(self, orders, timeout = 1.0):
+        """
+        Class MatchingEngine keeps an OrderBook per company id and fills
+        the limit orders at the simulated price, through the OrderQueue
+        orders so that fills are checked against the balance and holdings
+        and written to the transaction table like any other order.
+        match is called by the simulator ticker on every tick, and by
+        place for the book of the new order. It waits at most timeout
+        seconds for the fills, the ones still queued are settled by a
+        later match.
+        """
+        self.orders = orders
+        self.timeout = timeout
+        self.books = {}
+        self.lock = threading.Lock()
+        # (Order, limit_price, seq) of the fills not executed yet
+        self.in_flight = []
+
+    ############
+    # Methods
+    ############
+
+    def book(self, company_id):
+        with self.lock:
+            book = self.books.get(company_id)
+            if book is None:
+                book = self.books[company_id] = OrderBook()
+            return book
+
+    def load(self):
+        """
+        Rebuild the books from the open orders of the limit_order table,
+        used at start up and after the companies are reseeded.
+        """
+        books = {}
+        rows = db(db.limit_order.status == 'open').select(orderby=db.limit_order.id)
+        with self.lock:
+            in_flight = {order.limit_order_id for order, _, _ in self.in_flight}
+        for r in rows:
+            # Fills on their way are open until executed
+            if r.id in in_flight:
+                continue
+            if r.company_id not in books:
+                books[r.company_id] = OrderBook()
+            books[r.company_id].add(r.id, r.user_id, r.side, r.count, r.limit_price)
+        with self.lock:
+            self.books = books
+        return len(rows)
+
+    def place(self, user_id, company_id, side, count, limit_price, price):
+        """
+        Store a new limit order and add it to the book of its company,
+        then fill what the current price reaches. Commits, so that the
+        order exists for the writer thread before it can be filled.
+        Returns the id of the order.
+        """
+        order_id = db.limit_order.insert(user_id=user_id, company_id=company_id, side=side,
+                                         count=float(count), limit_price=float(limit_price))
+        db.commit()
+        self.book(company_id).add(order_id, user_id, side, float(count), float(limit_price))
+        self.match({company_id: price})
+        return order_id
+
+    def cancel(self, user_id, order_id):
+        """
+        Cancel an open order of the user, returns False if it is not
+        open anymore.
+        """
+        row = db.limit_order(order_id)
+        if row is None or row.user_id != user_id or row.status != 'open':
+            return False
+        if not self.book(row.company_id).cancel(order_id):
+            return False
+        row.update_record(status='cancelled')
+        return True
+
+    def match(self, prices):
+        """
+        Fill the orders reached by prices, a dictionary of company id to
+        price, and wait at most timeout seconds for the fills, these and
+        the ones left by earlier calls, to be executed. Returns the number
+        of orders filled.
+        """
+        pending = []
+        for company_id, price in prices.items():
+            book = self.books.get(company_id)
+            if not book:
+                continue
+            for order_id, user_id, side, count, limit_price, seq in book.fills(price):
+                pending.append((self.orders.enqueue(
+                    Order(user_id, company_id, side, count, price, limit_order_id=order_id)), limit_price, seq))
+        with self.lock:
+            pending, self.in_flight = self.in_flight + pending, []
+        deadline = time.monotonic() + self.timeout
+        filled = 0
+        waiting = []
+        for order, limit_price, seq in pending:
+            if not order.done.wait(max(deadline - time.monotonic(), 0)):
+                waiting.append((order, limit_price, seq))
+            elif order.error == OrderQueue.failed:
+                # Rolled back, the order is still open at its place
+                self.book(order.company_id).add(order.limit_order_id, order.user_id,
+                                                order.transaction_type, order.count, limit_price, seq)
+            elif order.error is None:
+                filled += 1
+        if waiting:
+            with self.lock:
+                self.in_flight.extend(waiting)
+        return filled
+
+    def match_snapshot(self, registry, quotes):
+        """
+        Fill the orders of every company with open orders at the prices
+        of a simulator snapshot.
+        """
+        if quotes.version != registry.version:
+            return 0
+        prices = {}
+        for company_id, book in list(self.books.items()):
+            i = quotes.companies.by_id.get(company_id)
+            if book and i is not None:
+                prices[company_id] = float(quotes.prices[i])
+        return self.match(prices)
@@ -0,0 +1,225 @@
+# Serialized execution of the buy and sell orders.
+import itertools
+import queue
+import threading
+import time
+from .common import db, logger
+from .models import get_time
+from .utilities import record_trade
+
+
+class Order:
+    __slots__ = ('user_id', 'company_id', 'transaction_type', 'count', 'value_per_share',
+                 'limit_order_id', 'done', 'result', 'error', 'shares')
+
+    def __init__(self, user_id, company_id, transaction_type, count, value_per_share, limit_order_id = None):
+        self.user_id = user_id
+        self.company_id = company_id
+        self.transaction_type = transaction_type
+        self.count = float(count)
+        self.value_per_share = float(value_per_share)
+        # The limit_order row this order fills, if any
+        self.limit_order_id = limit_order_id
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # Shares of the company the user has after the order
+        self.shares = None
+
+
+class OrderQueue:
+    # Error of the orders of a batch that failed and was rolled back
+    failed = 'The order could not be executed'
+    # Seconds a finished pending order is kept for poll
+    pending_retention = 600.0
+
+    # Constructor
+    def __init__(self, batch_size = 100, timeout = 10.0):
+        """
+        Class OrderQueue executes the orders of every request through one
+        writer thread, so that checking the balance and holdings of a user
+        and applying an order can never interleave with another order.
+        The writer takes the orders waiting in the queue, up to batch_size
+        at a time, applies them in order and commits them together in one
+        DB transaction. submit waits at most timeout seconds for the result,
+        orders still queued after that are kept as pending, to be polled.
+        Until start is called orders are executed by the calling thread,
+        in its own DB transaction.
+        The optional leaderboard is updated with every executed order, once
+        its batch is committed with the writer thread.
+        """
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.leaderboard = None
+        # order id -> (Order, user id, time it was left pending)
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.pending_ids = itertools.count(1)
+        self.orders = queue.Queue()
+        self.writer = None
+        self.writer_stop = threading.Event()
+
+    ############
+    # Methods
+    ############
+
+    def submit(self, user_id, company_id, transaction_type, count, value_per_share):
+        """
+        Execute a buy or a sell and return its result, a dictionary with
+        the new balance of the user. Raises ValueError if the order is
+        rejected (unknown user, balance too low, not enough shares) or
+        could not be executed.
+        If it is not executed within timeout seconds it still will be, and
+        the result is dict(pending=True, order_id=...) instead, order_id
+        to be given to poll.
+        """
+        order = self.enqueue(Order(user_id, company_id, transaction_type, count, value_per_share))
+        if not order.done.wait(self.timeout):
+            return dict(pending=True, order_id=self.keep_pending(order))
+        if order.error is not None:
+            raise ValueError(order.error)
+        return order.result
+
+    def keep_pending(self, order):
+        """
+        Keep an order that is still queued for poll and return its id.
+        Finished orders nobody polled are dropped after pending_retention
+        seconds.
+        """
+        now = time.monotonic()
+        with self.pending_lock:
+            for order_id, (kept, _, since) in list(self.pending.items()):
+                if kept.done.is_set() and now - since > self.pending_retention:
+                    del self.pending[order_id]
+            order_id = next(self.pending_ids)
+            self.pending[order_id] = (order, order.user_id, now)
+        return order_id
+
+    def poll(self, user_id, order_id):
+        """
+        Returns the result of a pending order of the user like submit,
+        dict(pending=True, order_id=order_id) while it is still queued, or
+        None for an unknown order. Raises ValueError if it was rejected.
+        A finished order is forgotten once polled.
+        """
+        with self.pending_lock:
+            kept = self.pending.get(order_id)
+            if kept is None or kept[1] != user_id:
+                return None
+            order = kept[0]
+            if not order.done.is_set():
+                return dict(pending=True, order_id=order_id)
+            del self.pending[order_id]
+        if order.error is not None:
+            raise ValueError(order.error)
+        return order.result
+
+    def enqueue(self, order):
+        """
+        Queue an Order without waiting for it and return it, its done
+        event is set once it is executed. Without the writer thread it is
+        executed right away.
+        """
+        if self.writer is None:
+            self.execute(order)
+            self.executed([order])
+            order.done.set()
+        else:
+            self.orders.put(order)
+        return order
+
+    def execute(self, order):
+        """
+        Check and apply one order in the current DB transaction. Rejected
+        orders get an error and leave the database unchanged, apart from
+        the status of the limit order they fill.
+        """
+        try:
+            user = db(db.user.user_id == order.user_id).select(db.user.id, db.user.user_balance).first()
+            if user is None:
+                raise ValueError('Unknown user')
+            total = order.count * order.value_per_share
+            if order.transaction_type == 'buy':
+                if total > user.user_balance:
+                    raise ValueError('Insufficient balance')
+                balance = round(user.user_balance - total, 2)
+            else:
+                balance = round(user.user_balance + total, 2)
+            # Raises before writing anything when selling more than is owned
+            holding = record_trade(order.user_id, order.company_id, order.transaction_type,
+                                   order.count, order.value_per_share)
+            db(db.user.id == user.id).update(user_balance=balance)
+            order.result = dict(balance=balance)
+            order.shares = holding['shares']
+        except ValueError as e:
+            order.error = str(e)
+        if order.limit_order_id is not None:
+            db(db.limit_order.id == order.limit_order_id).update(
+                status='rejected' if order.error else 'filled',
+                fill_price=None if order.error else order.value_per_share, filled=get_time())
+
+    def executed(self, orders):
+        """
+        Pass the orders that went through to the leaderboard.
+        """
+        if self.leaderboard is None:
+            return
+        for order in orders:
+            if order.error is None:
+                self.leaderboard.update(order.user_id, order.company_id, order.shares,
+                                        order.result['balance'])
+
+    def start(self):
+        """
+        Start the writer thread, from then on orders are group committed.
+        """
+        if self.writer is not None:
+            return
+        self.writer_stop.clear()
+        self.writer = threading.Thread(target=self.run_writer, name="OrderQueue-writer", daemon=True)
+        self.writer.start()
+
+    def stop(self):
+        """
+        Stop the writer thread started by start, after the current batch.
+        """
+        if self.writer is None:
+            return
+        self.writer_stop.set()
+        self.writer.join()
+        self.writer = None
+
+    def next_batch(self):
+        """
+        Wait for an order and return it with the ones queued behind it.
+        """
+        try:
+            batch = [self.orders.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.orders.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run_writer(self):
+        # this runs in its own thread, connect to db
+        db._adapter.reconnect()
+        while not self.writer_stop.is_set():
+            batch = self.next_batch()
+            if not batch:
+                continue
+            try:
+                for order in batch:
+                    self.execute(order)
+                db.commit()
+            except Exception:
+                logger.exception("OrderQueue batch failed")
+                db.rollback()
+                for order in batch:
+                    order.result, order.error = None, self.failed
+            self.executed(batch)
+            for order in batch:
+                order.done.set()
@@ -0,0 +1,187 @@
+# Persisted price history of the simulated companies.
+import datetime
+import numpy as np
+from .common import db
+
+
+class PriceHistory:
+    # Rollup resolutions in seconds. Raw ticks are stored with resolution 0.
+    resolutions = (60, 3600, 86400)
+    epoch = datetime.datetime(1970, 1, 1)
+
+    # Constructor
+    def __init__(self, tick, tick_retention = 3600):
+        """
+        Class PriceHistory appends every tick of the simulator to the
+        stock_history table and rolls the ticks up into 1 minute, 1 hour
+        and 1 day open/high/low/close buckets. Raw ticks are kept for
+        tick_retention seconds, rollups are never deleted.
+        tick is the update interval of the simulator, in seconds.
+        The buckets still being filled are kept in memory and rebuilt from
+        the stored ticks and finer rollups on the first tick, and after the
+        companies are written, so that a restart or a reseed does not
+        write bars covering only part of their interval.
+        """
+        self.tick = tick
+        self.tick_retention = tick_retention
+        # Registry version the open buckets belong to, None to rebuild
+        # them, and the position of each company id in their arrays
+        self.version = None
+        self.positions = {}
+        # resolution -> [bucket_time, open, high, low, close] of the
+        # bucket currently being filled, one value per company
+        self.buckets = {}
+
+    ############
+    # Methods
+    ############
+
+    def reset(self):
+        """
+        Rebuild the open buckets on the next tick, used when the companies
+        are written. The history of the companies left unchanged is still
+        stored, the one of the rewritten or deleted ones is not.
+        """
+        self.version = None
+
+    def bucket_time(self, t, resolution):
+        """
+        Returns the start of the bucket of the given resolution holding t.
+        """
+        return t - datetime.timedelta(seconds=(t - self.epoch).total_seconds() % resolution)
+
+    def record(self, registry, quotes):
+        """
+        Append the snapshot of one tick and close every rollup bucket
+        the tick has moved past. Must be called once per tick, in order.
+        """
+        if quotes.version != registry.version:
+            return
+        if quotes.version != self.version:
+            self.load(quotes.companies, quotes.time)
+        ids = quotes.companies.ids
+        prices = quotes.prices
+        db.stock_history.bulk_insert([
+            dict(company_id=int(c), resolution=0, bucket_time=quotes.time, close_value=float(p))
+            for c, p in zip(ids, prices)])
+        for resolution in self.resolutions:
+            start = self.bucket_time(quotes.time, resolution)
+            bucket = self.buckets.get(resolution)
+            if bucket is not None and bucket[0] != start:
+                self.write_bucket(ids, resolution, bucket)
+                if resolution == self.resolutions[0]:
+                    self.prune(quotes.time)
+                bucket = None
+            if bucket is None:
+                self.buckets[resolution] = [start, prices.copy(), prices.copy(), prices.copy(), prices.copy()]
+            else:
+                # Companies without stored ticks in the bucket open now
+                missing = np.isnan(bucket[1])
+                bucket[1][missing] = prices[missing]
+                np.fmax(bucket[2], prices, out=bucket[2])
+                np.fmin(bucket[3], prices, out=bucket[3])
+                bucket[4][:] = prices
+
+    def load(self, companies, time):
+        """
+        Rebuild the buckets holding time of the companies of a
+        RegistryState from the stored rows before time: the raw ticks of
+        the minute, then for every coarser resolution the closed buckets
+        of the finer one followed by its open bucket. Companies without
+        stored rows get NaN, filled by the next tick.
+        """
+        positions = {int(c): i for i, c in enumerate(companies.ids)}
+        buckets = {}
+        finer, finer_bucket = 0, None
+        for resolution in self.resolutions:
+            start = self.bucket_time(time, resolution)
+            end = time if finer_bucket is None else finer_bucket[0]
+            bucket = [start] + [np.full(len(positions), np.nan) for _ in range(4)]
+            rows = db((db.stock_history.resolution == finer)
+                      & (db.stock_history.bucket_time >= start)
+                      & (db.stock_history.bucket_time < end)).select(
+                db.stock_history.company_id, db.stock_history.open_value, db.stock_history.high_value,
+                db.stock_history.low_value, db.stock_history.close_value,
+                orderby=db.stock_history.bucket_time|db.stock_history.id)
+            for r in rows:
+                i = positions.get(r.company_id)
+                if i is not None:
+                    close = r.close_value
+                    self.merge(bucket, i, close if r.open_value is None else r.open_value,
+                               close if r.high_value is None else r.high_value,
+                               close if r.low_value is None else r.low_value, close)
+            if finer_bucket is not None:
+                for i in np.flatnonzero(~np.isnan(finer_bucket[1])):
+                    self.merge(bucket, i, *(float(a[i]) for a in finer_bucket[1:]))
+            buckets[resolution] = bucket
+            finer, finer_bucket = resolution, bucket
+        self.positions = positions
+        self.buckets = buckets
+        self.version = companies.version
+
+    def merge(self, bucket, i, open, high, low, close):
+        # Adds a later period to company i of a bucket
+        if np.isnan(bucket[1][i]):
+            bucket[1][i] = open
+        bucket[2][i] = np.fmax(bucket[2][i], high)
+        bucket[3][i] = np.fmin(bucket[3][i], low)
+        bucket[4][i] = close
+
+    def write_bucket(self, ids, resolution, bucket):
+        start, opens, highs, lows, closes = bucket
+        db.stock_history.bulk_insert([
+            dict(company_id=int(ids[i]), resolution=resolution, bucket_time=start,
+                 open_value=float(opens[i]), high_value=float(highs[i]),
+                 low_value=float(lows[i]), close_value=float(closes[i]))
+            for i in range(len(ids)) if not np.isnan(opens[i])])
+
+    def prune(self, now):
+        """
+        Delete the raw ticks older than the retention window.
+        """
+        cutoff = now - datetime.timedelta(seconds=self.tick_retention)
+        db((db.stock_history.resolution == 0) & (db.stock_history.bucket_time < cutoff)).delete()
+
+    def pick_resolution(self, start, end, max_points):
+        """
+        Returns the finest stored resolution that covers [start, end]
+        in at most max_points points.
+        """
+        duration = (end - start).total_seconds()
+        if duration <= self.tick_retention and duration / self.tick <= max_points:
+            return 0
+        for resolution in self.resolutions:
+            if duration / resolution <= max_points:
+                return resolution
+        return self.resolutions[-1]
+
+    def series(self, company_ids, start, end, max_points = 500):
+        """
+        Returns a dictionary mapping each company id to the (dates, prices)
+        stored between start and end, read at the resolution chosen by
+        pick_resolution. The first point is the one of the bucket holding
+        start, so that the series covers start when it is stored. The
+        bucket still being filled is included.
+        """
+        resolution = self.pick_resolution(start, end, max_points)
+        start = self.bucket_time(start, resolution or self.tick)
+        query = ((db.stock_history.company_id.belongs(list(company_ids)))
+                 & (db.stock_history.resolution == resolution)
+                 & (db.stock_history.bucket_time >= start)
+                 & (db.stock_history.bucket_time <= end))
+        rows = db(query).select(
+            db.stock_history.company_id, db.stock_history.bucket_time, db.stock_history.close_value,
+            orderby=db.stock_history.bucket_time)
+        series = {int(c): ([], []) for c in company_ids}
+        for r in rows:
+            dates, prices = series[r.company_id]
+            dates.append(r.bucket_time)
+            prices.append(r.close_value)
+        bucket = self.buckets.get(resolution)
+        if bucket is not None and start <= bucket[0] <= end:
+            for c, (dates, prices) in series.items():
+                i = self.positions.get(c)
+                if i is not None and not np.isnan(bucket[4][i]):
+                    dates.append(bucket[0])
+                    prices.append(float(bucket[4][i]))
+        return series
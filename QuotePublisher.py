@@ -0,0 +1,152 @@
+# Server-Sent Events stream of the simulated quotes.
+import json
+import threading
+from .common import db, logger
+
+
+class QuotePublisher:
+
+    # Constructor
+    def __init__(self, simulator, keepalive = 15.0):
+        """
+        Class QuotePublisher pushes the quotes of the simulator to every
+        subscriber of the quote stream. Once per tick its thread encodes
+        one event per subscribed symbol, whatever the number of
+        subscribers, and wakes them all with a single notify_all: each
+        subscriber only joins the events of its own symbols. Subscribers
+        are generators, so with an async server (gevent) thousands of
+        them cost one greenlet each. A comment is sent every keepalive
+        seconds without a tick so that proxies keep the stream open.
+        """
+        self.simulator = simulator
+        self.keepalive = keepalive
+        self.condition = threading.Condition()
+        # symbol -> number of subscribers
+        self.subscriptions = {}
+        # symbol -> encoded event of the last tick, replaced every tick
+        self.events = {}
+        self.tick = 0
+        self.publisher = None
+        self.publisher_stop = threading.Event()
+
+    ############
+    # Methods
+    ############
+
+    def subscribe(self, symbols):
+        with self.condition:
+            for s in symbols:
+                self.subscriptions[s] = self.subscriptions.get(s, 0) + 1
+
+    def unsubscribe(self, symbols):
+        with self.condition:
+            for s in symbols:
+                n = self.subscriptions.get(s, 0) - 1
+                if n > 0:
+                    self.subscriptions[s] = n
+                else:
+                    self.subscriptions.pop(s, None)
+
+    def encode(self, quotes, symbol):
+        """
+        Returns the event of one quote, or None for unknown symbols.
+        """
+        companies = quotes.companies
+        i = companies.by_symbol.get(symbol)
+        if i is None:
+            return None
+        price = float(quotes.prices[i])
+        data = dict(
+            co_id=int(companies.ids[i]),
+            co_symbol=symbol,
+            co_price=price,
+            co_change=float(quotes.changes[i]),
+            date=quotes.time.strftime("%m/%d/%Y, %H:%M:%S"),
+            time=self.simulator.to_epoch_ms(quotes.time),
+        )
+        return "event: quote\ndata: %s\n\n" % json.dumps(data)
+
+    def publish(self, quotes):
+        """
+        Encode the quotes of the subscribed symbols and wake up every
+        subscriber.
+        """
+        registry = self.simulator.registry
+        with self.condition:
+            symbols = list(self.subscriptions)
+        events = {}
+        if quotes.version == registry.version:
+            for s in symbols:
+                event = self.encode(quotes, s)
+                if event is not None:
+                    events[s] = event
+        with self.condition:
+            self.events = events
+            self.tick += 1
+            self.condition.notify_all()
+
+    def stream(self, symbols):
+        """
+        Generator of the event stream of the given symbols, the body of
+        one SSE response. It ends when the publisher is stopped or the
+        client goes away.
+        """
+        self.subscribe(symbols)
+        try:
+            yield "retry: 2000\n\n"
+            tick = self.tick
+            while not self.publisher_stop.is_set():
+                with self.condition:
+                    if self.tick == tick:
+                        self.condition.wait(self.keepalive)
+                    events = None if self.tick == tick else self.events
+                    tick = self.tick
+                if events is None:
+                    yield ": keepalive\n\n"
+                else:
+                    yield "".join(events[s] for s in symbols if s in events)
+        finally:
+            self.unsubscribe(symbols)
+
+    def start(self):
+        """
+        Start the publisher thread.
+        """
+        if self.publisher is not None:
+            return
+        self.publisher_stop.clear()
+        self.publisher = threading.Thread(target=self.run_publisher, name="QuotePublisher", daemon=True)
+        self.publisher.start()
+
+    def stop(self):
+        """
+        Stop the publisher thread and end every stream.
+        """
+        if self.publisher is None:
+            return
+        self.publisher_stop.set()
+        with self.condition:
+            self.condition.notify_all()
+        self.publisher.join()
+        self.publisher = None
+
+    def run_publisher(self):
+        # this runs in its own thread, connect to db
+        db._adapter.reconnect()
+        interval = self.simulator.update_interval
+        last_time = None
+        while not self.publisher_stop.is_set():
+            try:
+                if self.subscriptions:
+                    quotes = self.simulator.snapshot()
+                    if quotes.time != last_time:
+                        self.publish(quotes)
+                        last_time = quotes.time
+                # The snapshot may load the companies
+                db.commit()
+            except Exception:
+                db.rollback()
+                logger.exception("QuotePublisher failed")
+            elapsed = (self.simulator.get_time() - self.simulator.start_time).total_seconds()
+            # Wake up just after the tick, once the ticker has computed it
+            self.publisher_stop.wait(interval - elapsed % interval + 0.05)
@@ -0,0 +1,89 @@
+# Pool of read-only SQLite connections for the read-only actions.
+import threading
+from py4web.core import Fixture
+from pydal._globals import THREAD_LOCAL
+
+
+def apply_pragmas(connection, pragmas):
+    """
+    Run every "name=value" of pragmas on a DB-API connection.
+    """
+    for pragma in pragmas:
+        connection.execute("PRAGMA %s;" % pragma)
+
+
+class ReaderPool(Fixture):
+
+    # Constructor
+    def __init__(self, db, size, pragmas = (), session = None):
+        """
+        Class ReaderPool is a fixture to use instead of db on actions
+        that only read. For the duration of the request it replaces the
+        connection of db in the current thread with one of its own
+        read-only connections, so that every query made through db,
+        including the ones of the registry and the price history, runs
+        on it. With WAL these reads never wait on the writer.
+        Connections are opened with the given pragmas plus query_only,
+        and at most size of them are kept between requests.
+        db is a prerequisite, so that its own connection is set up first
+        and the actions can also use auth, which depends on db. So is the
+        optional session: sessions stored in db are read and saved on the
+        writer connection, the reader one being given back before auth and
+        the session save theirs.
+        """
+        self.db = db
+        self.__prerequisites__ = [db] + ([session] if session is not None else [])
+        self.size = size
+        self.pragmas = list(pragmas) + ["query_only=ON"]
+        self.lock = threading.Lock()
+        self.pool = []
+        self.requests = threading.local()
+
+    ############
+    # Methods
+    ############
+
+    def acquire(self):
+        """
+        Returns an idle reader connection, opening one if there is none.
+        """
+        with self.lock:
+            if self.pool:
+                return self.pool.pop()
+        connection = self.db._adapter.connector()
+        apply_pragmas(connection, self.pragmas)
+        return connection
+
+    def release(self, connection):
+        """
+        Ends the read transaction of connection and puts it back in the
+        pool, or closes it if the pool is full.
+        """
+        try:
+            connection.rollback()
+        except Exception:
+            connection.close()
+            return
+        with self.lock:
+            if len(self.pool) < self.size:
+                self.pool.append(connection)
+                return
+        connection.close()
+
+    def on_request(self, context = None):
+        adapter = self.db._adapter
+        self.requests.previous = getattr(THREAD_LOCAL, adapter._connection_uname_, None)
+        self.requests.connection = self.acquire()
+        adapter.set_connection(self.requests.connection, run_hooks=False)
+
+    def on_error(self, context = None):
+        self.on_success(context)
+
+    def on_success(self, context = None):
+        connection = getattr(self.requests, "connection", None)
+        if connection is None:
+            return
+        self.db._adapter.cursor.close()
+        self.db._adapter.set_connection(self.requests.previous, run_hooks=False)
+        self.requests.connection = self.requests.previous = None
+        self.release(connection)
@@ -0,0 +1,190 @@
+# Latency and SQL statement counts of the actions.
+import re
+import threading
+import time
+from py4web import request
+from py4web.core import Fixture
+
+
+class LatencyHistogram:
+
+    # Constructor
+    def __init__(self, sub_bucket_bits = 7):
+        """
+        Class LatencyHistogram counts non negative integer values in
+        buckets like an HDR histogram: values below 2**sub_bucket_bits
+        have a bucket each, and above that every power of two is split
+        into 2**(sub_bucket_bits - 1) buckets, so any value is known to
+        within 1 / 2**(sub_bucket_bits - 1) of itself whatever its
+        magnitude. Only the buckets in use are stored, keyed by their
+        lowest value.
+        """
+        self.sub_bucket_bits = sub_bucket_bits
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    ############
+    # Methods
+    ############
+
+    def record(self, value):
+        value = max(int(value), 0)
+        shift = max(value.bit_length() - self.sub_bucket_bits, 0)
+        key = (value >> shift) << shift
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        """
+        Returns the highest value of the bucket holding the p-th
+        percentile (0 to 100), at most the largest value recorded.
+        """
+        if not self.count:
+            return None
+        rank = max(p / 100 * self.count, 1)
+        seen = 0
+        for key in sorted(self.counts):
+            seen += self.counts[key]
+            if seen >= rank:
+                shift = max(key.bit_length() - self.sub_bucket_bits, 0)
+                return min(key + (1 << shift) - 1, self.max)
+        return self.max
+
+    def summary(self, scale = 1):
+        """
+        Returns the count, mean, min, percentiles and max, divided by
+        scale.
+        """
+        if not self.count:
+            return dict(count=0)
+        value = lambda v: round(v / scale, 3)
+        return dict(
+            count=self.count,
+            mean=value(self.total / self.count),
+            min=value(self.min),
+            p50=value(self.percentile(50)),
+            p90=value(self.percentile(90)),
+            p99=value(self.percentile(99)),
+            p999=value(self.percentile(99.9)),
+            max=value(self.max),
+        )
+
+
+class RequestMetrics(Fixture):
+    # Path segments made of digits, replaced so that the requests of
+    # one action share their histograms
+    ids = re.compile(r'/\d+(?=/|$)')
+
+    # Constructor
+    def __init__(self, db, query_budget = 50, logger = None):
+        """
+        Class RequestMetrics is a fixture recording, for every action it
+        is used by, the wall time of the request, the time spent in SQL
+        statements and their number, each in a LatencyHistogram. Add it
+        to the uses of an action, or make it a prerequisite of db to
+        measure every action using db. Statements are counted through an
+        execution handler of db, in the thread of the request, so the
+        ones run for it by other threads (the order writer) are not.
+        Requests running more than query_budget statements are logged
+        as warnings to logger.
+        """
+        self.db = db
+        self.query_budget = query_budget
+        self.logger = logger
+        self.lock = threading.Lock()
+        # action -> dict of its histograms and counters
+        self.actions = {}
+        self.started = time.time()
+        self.requests = threading.local()
+        metrics = self
+
+        class StatementTimer:
+            def __init__(self, adapter):
+                pass
+
+            def before_execute(self, command):
+                self.start = time.perf_counter()
+
+            def after_execute(self, command):
+                metrics.statement(time.perf_counter() - self.start)
+
+        db._adapter.execution_handlers.append(StatementTimer)
+
+    ############
+    # Methods
+    ############
+
+    def statement(self, seconds):
+        """
+        Count a statement of the request of the current thread, if any.
+        """
+        if getattr(self.requests, "start", None) is not None:
+            self.requests.statements += 1
+            self.requests.db_seconds += seconds
+
+    def on_request(self, context = None):
+        self.requests.statements = 0
+        self.requests.db_seconds = 0.0
+        self.requests.start = time.perf_counter()
+
+    def on_error(self, context = None):
+        self.finish(error=True)
+
+    def on_success(self, context = None):
+        self.finish(error=False)
+
+    def finish(self, error):
+        start = getattr(self.requests, "start", None)
+        if start is None:
+            return
+        wall = time.perf_counter() - start
+        statements, db_seconds = self.requests.statements, self.requests.db_seconds
+        self.requests.start = None
+        name = "%s %s" % (request.method, self.ids.sub("/<id>", request.path))
+        over_budget = statements > self.query_budget
+        with self.lock:
+            stats = self.actions.get(name)
+            if stats is None:
+                stats = self.actions[name] = dict(
+                    wall=LatencyHistogram(), db=LatencyHistogram(), statements=LatencyHistogram(),
+                    errors=0, over_budget=0)
+            # Times are recorded in microseconds
+            stats['wall'].record(wall * 1e6)
+            stats['db'].record(db_seconds * 1e6)
+            stats['statements'].record(statements)
+            stats['errors'] += error
+            stats['over_budget'] += over_budget
+        if over_budget and self.logger is not None:
+            self.logger.warning(f'{name} ran {statements} SQL statements (budget {self.query_budget}) '
+                                f'in {wall * 1000:.1f} ms, {db_seconds * 1000:.1f} ms in the database')
+
+    def reset(self):
+        with self.lock:
+            self.actions = {}
+            self.started = time.time()
+
+    def stats(self):
+        """
+        Returns the summary of every action, the ones that took the most
+        time in total first, with times in milliseconds.
+        """
+        with self.lock:
+            actions = sorted(self.actions.items(), key=lambda a: -a[1]['wall'].total)
+            return dict(
+                seconds=round(time.time() - self.started),
+                query_budget=self.query_budget,
+                actions={name: dict(
+                    requests=stats['wall'].count,
+                    errors=stats['errors'],
+                    over_budget=stats['over_budget'],
+                    wall_ms=stats['wall'].summary(1000),
+                    db_ms=stats['db'].summary(1000),
+                    statements=stats['statements'].summary(),
+                ) for name, stats in actions},
+            )
@@ -0,0 +1,105 @@
+# Cache of the JSON responses of the read endpoints, per price tick.
+import collections
+import threading
+
+
+class ResponseCache:
+
+    # Constructor
+    def __init__(self, simulator, budget = 16 * 1024 * 1024):
+        """
+        Class ResponseCache keeps the encoded JSON responses of the read
+        endpoints for the current price tick, keyed by endpoint and
+        arguments. All entries expire together when the tick of the
+        simulator moves or the companies are reseeded (registry version),
+        since every answer depends on both. Within a tick entries are
+        evicted least recently used first to keep their total size under
+        budget bytes, counted UTF-8 encoded. Hits, misses and evictions are counted for stats.
+        Without ticks (no update_interval) every request has its own time
+        and nothing is cached.
+        """
+        self.simulator = simulator
+        self.budget = budget
+        self.lock = threading.Lock()
+        # key -> (JSON text, its size in bytes)
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.tick = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    ############
+    # Methods
+    ############
+
+    def current_tick(self):
+        """
+        Returns the (time, registry version) the responses are valid for.
+        """
+        self.simulator.update_current_time()
+        return (self.simulator.current_time, self.simulator.registry.version)
+
+    def get(self, endpoint, args, compute):
+        """
+        Returns the cached JSON text for endpoint and args (a tuple) at the
+        current tick, or calls compute, which must return the JSON text,
+        caches its result and returns it.
+        """
+        if not self.simulator.update_interval:
+            return compute()
+        tick = self.current_tick()
+        key = (endpoint, args)
+        with self.lock:
+            if tick != self.tick:
+                self.expire(tick)
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        text = compute()
+        size = len(text.encode())
+        # A text computed across a tick may mix prices of both
+        if size > self.budget or self.current_tick() != tick:
+            return text
+        with self.lock:
+            if tick != self.tick or key in self.entries:
+                return text
+            self.entries[key] = (text, size)
+            self.size += size
+            while self.size > self.budget:
+                _, (_, old_size) = self.entries.popitem(last=False)
+                self.size -= old_size
+                self.evictions += 1
+        return text
+
+    def expire(self, tick):
+        # Caller holds the lock
+        self.expirations += len(self.entries)
+        self.entries.clear()
+        self.size = 0
+        self.tick = tick
+
+    def invalidate(self):
+        """
+        Drop every entry.
+        """
+        with self.lock:
+            self.expire(None)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return dict(
+                entries=len(self.entries),
+                size=self.size,
+                budget=self.budget,
+                hits=self.hits,
+                misses=self.misses,
+                hit_ratio=round(self.hits / lookups, 4) if lookups else None,
+                evictions=self.evictions,
+                expirations=self.expirations,
+            )
@@ -0,0 +1,126 @@
+# Search index over the names and symbols of the companies.
+import heapq
+import threading
+
+
+class SearchIndex:
+    # Queries shorter than this are looked up in the prefix map,
+    # longer ones through their trigrams.
+    gram = 3
+    # Trigrams a single typo can change
+    typo_grams = 3
+
+    # Constructor
+    def __init__(self, registry):
+        """
+        Class SearchIndex answers company searches with the top k matches
+        without looking at every company. Symbols and names are lowercased
+        and indexed by trigram, and their short prefixes (and the ones of
+        every word of the name) are mapped to the companies directly.
+        Only the candidates found this way are scored. The index is built
+        from a RegistryState of the CompanyRegistry and rebuilt on first
+        use after the registry version changes, so whenever the companies
+        are written. The state it was built from and the maps built from
+        it are replaced together, in one assignment.
+        """
+        self.registry = registry
+        self.lock = threading.Lock()
+        # (RegistryState, grams, prefixes, symbols, names)
+        self.built = None
+
+    ############
+    # Methods
+    ############
+
+    def trigrams(self, text):
+        return {text[i:i + self.gram] for i in range(len(text) - self.gram + 1)}
+
+    def ensure_built(self):
+        """
+        Build the index from the registry if it has changed since, returns
+        what find searches.
+        """
+        state = self.registry.current()
+        built = self.built
+        if built is not None and built[0].version == state.version:
+            return built
+        with self.lock:
+            if self.built is not None and self.built[0].version == state.version:
+                return self.built
+            symbols = [s.lower() for s in state.symbols]
+            names = [n.lower() for n in state.names]
+            grams, prefixes = {}, {}
+            for i, (symbol, name) in enumerate(zip(symbols, names)):
+                for g in self.trigrams(symbol) | self.trigrams(name):
+                    grams.setdefault(g, set()).add(i)
+                for word in {symbol, name} | set(name.split()):
+                    for n in range(1, self.gram):
+                        if len(word) >= n:
+                            prefixes.setdefault(word[:n], set()).add(i)
+            self.built = (state, grams, prefixes, symbols, names)
+            return self.built
+
+    def candidates(self, built, query):
+        """
+        Returns the registry positions sharing at least half of the
+        trigrams of the query, and all but typo_grams of them for long
+        queries, or matching its prefix if the query is short.
+        A company with that many of the trigrams has at least one of the
+        rarest ones, so only the postings of those are walked, the others
+        are only probed.
+        """
+        _, grams, prefixes, _, _ = built
+        if len(query) < self.gram:
+            return prefixes.get(query, ())
+        postings = sorted((grams.get(g, set()) for g in self.trigrams(query)), key=len)
+        needed = max((len(postings) + 1) // 2, len(postings) - self.typo_grams)
+        seeds = set().union(*postings[:len(postings) - needed + 1])
+        return [i for i in seeds if sum(i in p for p in postings) >= needed]
+
+    def score(self, built, i, query):
+        """
+        Rank of company i for the query, higher is better, 0 for no match.
+        Exact symbols come first, then prefixes of the symbol, the name and
+        its words, then substrings, then names sharing enough trigrams.
+        """
+        symbol, name = built[3][i], built[4][i]
+        if symbol == query:
+            return 100
+        if symbol.startswith(query):
+            return 80
+        if name.startswith(query):
+            return 70
+        if any(w.startswith(query) for w in name.split()):
+            return 60
+        if query in symbol or query in name:
+            return 40
+        if len(query) < self.gram:
+            return 0
+        query_grams = self.trigrams(query)
+        shared = len(query_grams & (self.trigrams(symbol) | self.trigrams(name)))
+        return 20 * shared // len(query_grams)
+
+    def find(self, query, k = 20):
+        """
+        Returns the RegistryState the index was built from and the
+        positions in it of the k best matches of query, best first. An
+        empty query returns the first k companies.
+        """
+        built = self.ensure_built()
+        state, _, _, symbols, names = built
+        query = query.strip().lower()
+        if not query:
+            return state, list(range(min(k, len(symbols))))
+        scored = []
+        for i in self.candidates(built, query):
+            score = self.score(built, i, query)
+            if score > 0:
+                scored.append((-score, len(names[i]), symbols[i], i))
+        return state, [i for _, _, _, i in heapq.nsmallest(k, scored)]
+
+    def search(self, query, k = 20):
+        """
+        Returns the positions of the k best matches of query, like find,
+        for callers that do not need the RegistryState.
+        """
+        return self.find(query, k)[1]
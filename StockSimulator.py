@@ -1,24 +1,72 @@
 # Simulator class to simulate stock prices of companies.
 import datetime
+import itertools
 from pytz import timezone
 import random
 import math
-from .common import db
+import threading
+import numpy as np
+from .common import db, logger
+from .CompanyRegistry import CompanyRegistry
+from .SearchIndex import SearchIndex
+
+
+class QuoteSnapshot:
+    """
+    Prices of every company of a RegistryState at one tick. Arrays are
+    indexed like the arrays of that state, kept in companies. A snapshot
+    is never written once published, every tick gets new arrays, so
+    readers can keep using the one they got while the next tick is
+    computed.
+    """
+    __slots__ = ('time', 'version', 'companies', 'prices', 'changes')
+
+    def __init__(self, companies):
+        self.time = None
+        self.version = companies.version
+        self.companies = companies
+        self.prices = np.empty(len(companies))
+        self.changes = np.empty(len(companies))
 
 
 class StockSimulator:
     # Class variables
     names_file = "./apps/StockMarketImitation/static/text-files/company-names.json"
+    # Number of sine terms summed by the noise function
+    sim_level = 30
+    levels = np.arange(sim_level, dtype=float)
+    level_scales = np.power(1.2, levels)
+    # Upper bound on the (companies x timestamps x levels) elements
+    # evaluated at once by change_grid, to keep memory flat.
+    grid_budget = 1 << 20
+    epoch = datetime.datetime(1970, 1, 1)
 
     # Constructor
-    def __init__(self, update_intervali = None):
+    def __init__(self, update_interval = None):
         """
         Class StockSimulator provides utilities for
         simulating a number of companies in real time.
+        If update_interval (in seconds) is given, the simulator runs in
+        ticker mode: time advances in ticks of that length and the prices
+        at the current tick are computed once, into a snapshot shared by
+        every caller.
         """
         # Define instance variables
+        self.update_interval = update_interval
         self.start_time = self.get_time()
         self.current_time = self.get_time()
+        self.registry = CompanyRegistry()
+        # Index of the names and symbols, rebuilt when the companies change
+        self.search_index = SearchIndex(self.registry)
+        # Snapshot of the current tick
+        self.quotes = None
+        self.quote_lock = threading.Lock()
+        self.ticker = None
+        self.ticker_stop = threading.Event()
+        # Optional PriceHistory the ticker appends every tick to
+        self.history = None
+        # Optional MatchingEngine the ticker fills limit orders with
+        self.matching = None
 
     ############ 
     # Methods
@@ -32,19 +80,105 @@ class StockSimulator:
         with num_companies new companies beginning at the given initial
         values with the given names and symbols.
         Prescribe default strings if names is None or symbols is None.
-        TODO stock history is not used right now and needs to be removed. 
+        Truncating the company table deletes the transactions, holdings and
+        limit orders referencing it, see seed_database for the start up.
         """
 
         # Empty db
+        db.stock_history.truncate()
         db.company.truncate()
-        for s in companies:
-            # Add company to db
-            id = db.company.insert(
-                company_name = companies[s]['name'],
-                company_symbol = s,
-                current_stock_value = companies[s]['value'],
-                changes = companies[s]['change'],
-            )
+        db.company.bulk_insert([self.company_fields(s, c) for s, c in companies.items()])
+        self.companies_changed()
+
+    def seed_database(self, companies = dict(), chunk_size = 1000):
+        """
+        Make the company table hold the given companies, a dictionary like
+        initialize_database takes or an iterable of (symbol, company)
+        pairs read chunk_size at a time, safe to run on every start.
+        Nothing is written if the stored rows already match them.
+        Otherwise, in one DB transaction, the companies that differ are
+        updated in place, keeping their ids and everything referencing
+        them apart from their now stale price history, the missing ones
+        are bulk inserted, and the stored ones that are not in companies
+        are deleted with their transactions, holdings, limit orders and
+        history, leaving the same companies as initialize_database.
+        Returns the number of companies written or deleted.
+        """
+        if isinstance(companies, dict):
+            companies = companies.items()
+        companies = iter(companies)
+        seen = set()
+        written = inserted = 0
+        try:
+            while True:
+                chunk = list(itertools.islice(companies, chunk_size))
+                if not chunk:
+                    break
+                rows = db(db.company.company_symbol.belongs([s for s, _ in chunk])).select(
+                    db.company.id, db.company.company_symbol, db.company.company_name,
+                    db.company.current_stock_value, db.company.changes)
+                stored = {r.company_symbol: r for r in rows}
+                new = []
+                for s, c in chunk:
+                    seen.add(s)
+                    r = stored.get(s)
+                    if r is None:
+                        new.append(self.company_fields(s, c))
+                    elif self.company_key(s, c) != self.company_key(s, dict(
+                            name=r.company_name, value=r.current_stock_value, change=r.changes)):
+                        db(db.company.id == r.id).update(**self.company_fields(s, c))
+                        db(db.stock_history.company_id == r.id).delete()
+                        written += 1
+                db.company.bulk_insert(new)
+                inserted += len(new)
+            extra = [r.id for r in db(db.company).select(db.company.id, db.company.company_symbol)
+                     if r.company_symbol not in seen]
+            for i in range(0, len(extra), chunk_size):
+                ids = extra[i:i + chunk_size]
+                for table in (db.stock_history, db.transaction, db.holding, db.limit_order):
+                    db(table.company_id.belongs(ids)).delete()
+                db(db.company.id.belongs(ids)).delete()
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        if not (written or inserted or extra):
+            return 0
+        logger.info(f'Seeded {written} updated and {inserted} new companies, deleted {len(extra)}')
+        self.companies_changed()
+        return written + inserted + len(extra)
+
+    def company_fields(self, symbol, company):
+        """
+        Return the company table fields of a company of the dictionary
+        taken by initialize_database.
+        """
+        return dict(
+            company_name = company['name'],
+            company_symbol = symbol,
+            current_stock_value = company['value'],
+            changes = company['change'],
+        )
+
+    def company_key(self, symbol, company):
+        """
+        Return the symbol, name, initial value and change of a company,
+        equal for a company and its stored row.
+        """
+        # + 0.0 turns -0.0, which the database may store as 0.0, into 0.0
+        return (symbol, company['name'], float(company['value']) + 0.0, float(company['change']) + 0.0)
+
+    def companies_changed(self):
+        """
+        Reload everything derived from the company table after it was
+        written.
+        """
+        self.registry.invalidate()
+        if self.history is not None:
+            self.history.reset()
+        if self.matching is not None:
+            self.matching.load()
+        self.search_index.ensure_built()
 
     def load_companies(self, current_time = None):
         """
@@ -54,54 +188,223 @@ class StockSimulator:
         Before returning, the stocka are updated with the current value
         TODO, the key should  probably be the symbol instead. 
         """
-        self.update_current_time()
         companies = {}
-        db_companies = db(db.company).select().as_list()
+        if current_time is None and self.update_interval:
+            quotes = self.snapshot()
+            for i in range(len(quotes.companies)):
+                c = self.quote(i, quotes)
+                companies[c['id']] = c
+            return companies
 
-        for c in db_companies:
+        state = self.registry.current()
+        self.update_current_time()
+        change = self.change_grid(state.ids, [current_time])
+        for i, k in enumerate(change[:, 0]):
+            c = self.apply_change(state.record(i), k)
             companies[c['id']] = c
-        for c in companies: 
-            companies[c]['current_stock_value'] = companies[c]['current_stock_value'] * self.change_function(current_time) 
-            companies[c]['changes'] = companies[c]['current_stock_value'] * (self.change_function(current_time) - 1)
-            companies[c]['latest_update'] = self.current_time
         return companies
 
     def load_company(self, symbol, current_time = None):
         assert(symbol != None)
 
+        if current_time is None and self.update_interval:
+            quotes = self.snapshot()
+            i = quotes.companies.index(symbol)
+            if i is None:
+                raise KeyError(f'Unknown company {symbol}')
+            return self.quote(i, quotes)
+        state = self.registry.current()
+        i = state.index(symbol)
+        if i is None:
+            raise KeyError(f'Unknown company {symbol}')
+        self.update_current_time()
+        company = state.record(i)
+        return self.apply_change(company, self.change_function(current_time, company['id']))
+
+    def price_series(self, symbols, times):
+        """
+        Return a dictionary mapping each known symbol in symbols to the
+        list of its prices at the given times. The companies are looked
+        up in the registry and priced with a single change_grid call.
+        """
+        state = self.registry.current()
+        idx = [i for i in map(state.index, symbols) if i is not None]
+        prices = self.price_matrix(idx, times, state)
+        return {state.symbols[i]: prices[j].tolist() for j, i in enumerate(idx)}
+
+    def price_matrix(self, idx, times, state = None):
+        """
+        Return the (len(idx), len(times)) array of the prices of the
+        companies at positions idx of the registry state (by default the
+        current one) at the given times.
+        """
+        self.update_current_time()
+        state = self.registry.current() if state is None else state
+        return state.values[idx, None] * self.change_grid(state.ids[idx], times)
+
+    def current_prices(self, keys):
+        """
+        Return an array with the current price of each company in keys,
+        given by id or symbol. In ticker mode the prices are read from the
+        snapshot, otherwise they are computed with one change_grid call.
+        """
+        quotes = self.snapshot() if self.update_interval else None
+        state = quotes.companies if quotes is not None else self.registry.current()
+        idx = [state.index(k) for k in keys]
+        if None in idx:
+            raise KeyError(f'Unknown company {keys[idx.index(None)]}')
+        if quotes is not None:
+            return quotes.prices[idx]
+        self.update_current_time()
+        change = self.change_grid(state.ids[idx], [self.current_time])[:, 0]
+        return state.values[idx] * change
+
+    def quote_companies(self, idx, state = None):
+        """
+        Return the companies at positions idx of the registry state (by
+        default the current one) as priced company dictionaries, like
+        load_companies but for those companies only.
+        """
+        state = self.registry.current() if state is None else state
+        if self.update_interval:
+            quotes = self.snapshot()
+            if quotes.companies is state:
+                return [self.quote(i, quotes) for i in idx]
         self.update_current_time()
-        if type(symbol) is int:
-            company = db.company[symbol]
-        else:
-            company = db(db.company.company_symbol == symbol).select().as_list()[0]
-        company['current_stock_value'] = company['current_stock_value'] * self.change_function(current_time, company['id']) 
-        company['changes'] = company['current_stock_value'] * (self.change_function(current_time, company['id']) - 1)
+        change = self.change_grid(state.ids[list(idx)], [self.current_time])[:, 0]
+        return [self.apply_change(state.record(i), float(k)) for i, k in zip(idx, change)]
+
+    def apply_change(self, company, change):
+        """
+        Price a company row with the given change factor, as returned by
+        change_function or change_grid.
+        """
+        company['current_stock_value'] = company['current_stock_value'] * change
+        company['changes'] = company['current_stock_value'] * (change - 1)
         company['latest_update'] = self.current_time
         return company
 
+    def quote(self, i, quotes):
+        """
+        Return the company at position i of the given snapshot, priced
+        from it.
+        """
+        company = quotes.companies.record(i)
+        company['current_stock_value'] = float(quotes.prices[i])
+        company['changes'] = float(quotes.changes[i])
+        company['latest_update'] = quotes.time
+        return company
+
+    def snapshot(self):
+        """
+        Return the QuoteSnapshot of the current tick, computing it
+        first if the ticker thread has not done so yet.
+        """
+        self.update_current_time()
+        quotes = self.quotes
+        if (quotes is None or quotes.time != self.current_time
+                or quotes.companies is not self.registry.current()):
+            quotes = self.refresh_snapshot(self.current_time)
+        return quotes
+
+    def refresh_snapshot(self, time):
+        """
+        Price every company at the given tick time into a new snapshot
+        and publish it.
+        """
+        with self.quote_lock:
+            state = self.registry.current()
+            quotes = self.quotes
+            if quotes is not None and quotes.time == time and quotes.companies is state:
+                return quotes
+            fresh = QuoteSnapshot(state)
+            change = self.change_grid(state.ids, [time])[:, 0]
+            np.multiply(state.values, change, out=fresh.prices)
+            np.multiply(fresh.prices, change - 1, out=fresh.changes)
+            fresh.time = time
+            self.quotes = fresh
+            return fresh
+
+    def start_ticker(self):
+        """
+        Start a daemon thread computing the snapshot at every tick, so
+        that requests only ever read it.
+        """
+        assert self.update_interval, "The ticker needs an update_interval"
+        if self.ticker is not None:
+            return
+        self.ticker_stop.clear()
+        self.ticker = threading.Thread(target=self.run_ticker, name="StockSimulator-ticker", daemon=True)
+        self.ticker.start()
+
+    def stop_ticker(self):
+        """
+        Stop the ticker thread started by start_ticker.
+        """
+        if self.ticker is None:
+            return
+        self.ticker_stop.set()
+        self.ticker.join()
+        self.ticker = None
+
+    def run_ticker(self):
+        # this runs in its own thread, connect to db
+        db._adapter.reconnect()
+        last_time = None
+        while not self.ticker_stop.is_set():
+            try:
+                quotes = self.snapshot()
+                if quotes.time != last_time:
+                    if self.history is not None:
+                        self.history.record(self.registry, quotes)
+                    # Commit the history first, fills are written by the
+                    # order writer thread
+                    db.commit()
+                    if self.matching is not None:
+                        self.matching.match_snapshot(self.registry, quotes)
+                    last_time = quotes.time
+                db.commit()
+            except Exception:
+                db.rollback()
+                logger.exception("StockSimulator ticker failed")
+            elapsed = (self.get_time() - self.start_time).total_seconds()
+            self.ticker_stop.wait(self.update_interval - elapsed % self.update_interval)
 
     def update_current_time(self): 
         """
         This will update the current_time field in the simulator with the EST current time. 
+        In ticker mode the time is rounded down to the start of the current tick.
         """
         self.current_time = self.get_time()
+        if self.update_interval:
+            elapsed = (self.current_time - self.start_time).total_seconds()
+            self.current_time -= datetime.timedelta(seconds=elapsed % self.update_interval)
 
     def change_function(self, current_time = None, id = 0):
         """
         Deterministic noise for the stocks returns a value ~1.  
         """
-        if current_time == None:
-            current_time = self.current_time
-        time_diff = (current_time - self.start_time).total_seconds()
+        return float(self.change_grid([id], [current_time])[0, 0])
 
-        change = 0
-        sim_level = 30
-        for i in range(sim_level):
-            x  = time_diff
-            change += i * math.pow(math.sin( (x + 1000*id)/math.pow(1.2,i) + i),39)
-        change = 1 + 0.01 * change / sim_level
+    def change_grid(self, ids, times):
+        """
+        Vectorized change_function. Returns an array of shape
+        (len(ids), len(times)) whose [c, t] entry is
+        change_function(times[t], ids[c]).
+        A time of None means the current time of the simulator.
+        """
+        offsets = np.array([
+            ((self.current_time if t is None else t) - self.start_time).total_seconds()
+            for t in times], dtype=float)
+        ids = np.asarray(ids, dtype=float)
+        change = np.empty((len(ids), len(offsets)))
+        rows = max(1, self.grid_budget // max(1, len(offsets) * self.sim_level))
+        for lo in range(0, len(ids), rows):
+            x = offsets[None, :] + 1000 * ids[lo:lo + rows, None]
+            terms = np.power(np.sin(x[..., None] / self.level_scales + self.levels), 39)
+            change[lo:lo + rows] = terms @ self.levels
         #noise
-        return change
+        return 1 + 0.01 * change / self.sim_level
 
     def get_time(self):
         """
@@ -111,3 +414,15 @@ class StockSimulator:
         # nyc = timezone('America/New_York')
         # return now.astimezone(nyc)
         return datetime.datetime.utcnow()
+
+    def to_epoch_ms(self, t):
+        """
+        Returns the milliseconds since the epoch of a datetime of get_time.
+        """
+        return int((t - self.epoch).total_seconds() * 1000)
+
+    def from_epoch_ms(self, ms):
+        """
+        Returns the datetime of milliseconds since the epoch.
+        """
+        return self.epoch + datetime.timedelta(milliseconds=ms)
@@ -0,0 +1,328 @@
+"""
+Benchmarks for the simulator, portfolio and forum hot paths.
+
+The app is loaded against an in-memory SQLite database, seeded with
+synthetic data at the requested scale, and every case is timed.
+Run it as a script, not with -m, so that the database can be swapped
+before the app is imported:
+
+    python apps/StockMarketImitation/benchmark.py --companies 1000 --transactions 2000 --comments 500
+
+The results are printed as one JSON document (or written to --output),
+with per case throughput, latency percentiles and SQL statements per call.
+
+With --check-plans it only runs EXPLAIN QUERY PLAN on the hot queries of
+models.py and exits with status 1 if any of them scans a table.
+
+The companies are loaded through the CompanyLoader, whose rows per second
+are reported under company_loader.
+
+The concurrency cases run --threads threads of simulated requests against
+a temporary SQLite file, once with each storage profile of settings.py,
+and report their throughput, latency and "database is locked" errors.
+"""
+import argparse
+import datetime
+import importlib
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+APP_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_app():
+    """
+    Import the app on an in-memory database with the ticker and the order
+    writer threads off, returns its package.
+    """
+    os.environ["STOCKSIM_DB_URI"] = "sqlite:memory"
+    os.environ["STOCKSIM_TICKER"] = "off"
+    os.environ["STOCKSIM_ORDER_QUEUE"] = "off"
+    apps_folder = os.path.dirname(APP_FOLDER)
+    sys.path.insert(0, os.path.dirname(apps_folder))
+    return importlib.import_module(os.path.basename(apps_folder) + "." + os.path.basename(APP_FOLDER))
+
+
+class QueryCounter:
+    """
+    pydal execution handler counting the statements run and their time.
+    """
+    count = 0
+    seconds = 0.0
+
+    def __init__(self, adapter):
+        self.adapter = adapter
+
+    def before_execute(self, command):
+        self.t0 = time.perf_counter()
+
+    def after_execute(self, command):
+        QueryCounter.count += 1
+        QueryCounter.seconds += time.perf_counter() - self.t0
+
+
+############
+# Seeding
+############
+
+def seed_companies(app, simulator, n):
+    """
+    Load n synthetic companies through the CompanyLoader from a CSV file
+    without values, so that they are generated. Returns the company ids
+    and the loading stats.
+    """
+    folder = tempfile.mkdtemp(prefix="stocksim-bench-")
+    try:
+        path = os.path.join(folder, "companies.csv")
+        with open(path, "w") as f:
+            f.write("symbol,name\n")
+            for i in range(n):
+                f.write(f"SYM{i},Synthetic Company {i}\n")
+        stats = app.CompanyLoader.CompanyLoader().load(simulator, path)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    simulator.registry.ensure_loaded()
+    return [int(i) for i in simulator.registry.current().ids], stats
+
+
+def seed_user(db, n):
+    user_id = db.auth_user.insert(first_name="Bench", last_name=f"User{n}", email=f"bench{n}@example.com")
+    db.user.insert(user_id=user_id, user_balance=100000)
+    return user_id
+
+
+def seed_transactions(db, user_id, company_ids, m, held=50):
+    """
+    Insert m buys and sells for the user, spread over the last ten minutes
+    and over at most held companies. Never sells more than is owned.
+    """
+    now = datetime.datetime.utcnow()
+    companies = random.sample(company_ids, min(held, len(company_ids)))
+    holdings = {}
+    rows = []
+    for i in range(m):
+        date = now - datetime.timedelta(seconds=600 * (m - i) / m)
+        owned = [c for c, v in holdings.items() if v > 0]
+        if owned and random.random() < 0.3:
+            c = random.choice(owned)
+            count = random.randint(1, holdings[c])
+            holdings[c] -= count
+            kind = 'sell'
+        else:
+            c = random.choice(companies)
+            count = random.randint(1, 20)
+            holdings[c] = holdings.get(c, 0) + count
+            kind = 'buy'
+        rows.append(dict(company_id=c, user_id=user_id, transaction_type=kind, count=count,
+                         value_per_share=round(random.uniform(5, 500), 2), transaction_date=date))
+    db.transaction.bulk_insert(rows)
+
+
+def seed_comments(db, user_ids, k, reactions):
+    """
+    Insert a post with k comments, a third of them replies, and up to
+    reactions likes or dislikes per comment. Returns the post id.
+    """
+    topic_id = db.forum_topic.insert(topic="Benchmark")
+    post_id = db.forum_post.insert(user_id=user_ids[0], topic_id=topic_id,
+                                   post_title="Benchmark", post_content="Benchmark")
+    top_level = []
+    for i in range(k):
+        parent = random.choice(top_level) if top_level and random.random() < 0.33 else -1
+        comment_id = db.forum_comment.insert(user_id=random.choice(user_ids), post_id=post_id,
+                                             parent_idx=parent, comment=f"Comment {i}")
+        if parent == -1:
+            top_level.append(comment_id)
+        voters = random.sample(user_ids, min(len(user_ids), random.randint(0, reactions)))
+        db.reaction_comment.bulk_insert([
+            dict(comment_id=comment_id, user_id=u, reaction=random.choice((1, -1))) for u in voters])
+    return post_id
+
+
+############
+# Timing
+############
+
+def percentile(values, p):
+    """
+    Nearest rank percentile of sorted values.
+    """
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def latency_summary(latencies):
+    latencies.sort()
+    ms = lambda s: round(s * 1000, 3)
+    return {
+        'mean': ms(sum(latencies) / len(latencies)),
+        'p50': ms(percentile(latencies, 50)),
+        'p90': ms(percentile(latencies, 90)),
+        'p99': ms(percentile(latencies, 99)),
+        'max': ms(latencies[-1]),
+    }
+
+
+def run_case(name, fn, repeat, warmup = 1):
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    count, seconds = QueryCounter.count, QueryCounter.seconds
+    start = time.perf_counter()
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t0)
+    total = time.perf_counter() - start
+    return {
+        'case': name,
+        'calls': repeat,
+        'throughput_per_s': round(repeat / total, 2),
+        'latency_ms': latency_summary(latencies),
+        'queries_per_call': round((QueryCounter.count - count) / repeat, 2),
+        'db_ms_per_call': round((QueryCounter.seconds - seconds) / repeat * 1000, 3),
+    }
+
+
+def concurrency_case(app, profile, threads, requests, read_ratio):
+    """
+    Run requests simulated requests spread over threads threads on a new
+    SQLite file opened with the storage profile. Every request reads its
+    session row and writes it back, like the session fixture does since
+    auth updates the session on every request. read_ratio of them only
+    read prices in between, through the reader pool when the profile has
+    one, given back before the session is saved as in the fixture chain;
+    the others record a trade on the writer connection.
+    """
+    from pydal import DAL, Field
+    from pydal._globals import THREAD_LOCAL
+    folder = tempfile.mkdtemp()
+    pragmas = app.common.storage_pragmas(profile)
+    db = DAL("sqlite://concurrency.db", folder=folder, pool_size=threads,
+             after_connection=lambda adapter: app.ReaderPool.apply_pragmas(adapter.connection, pragmas))
+    db.define_table('bench_session', Field('rkey'), Field('rvalue', 'text'))
+    db.define_table('bench_price', Field('symbol'), Field('value', 'float'))
+    db.define_table('bench_trade', Field('session_id', 'integer'), Field('symbol'), Field('count', 'integer'))
+    db.bench_session.bulk_insert([dict(rkey=f"s{i}", rvalue="{}") for i in range(threads)])
+    db.bench_price.bulk_insert([dict(symbol=f"SYM{i}", value=100.0) for i in range(100)])
+    db.commit()
+    reader = app.ReaderPool.ReaderPool(db, threads, [p for p in pragmas if not p.startswith("journal_mode")]) \
+        if pragmas else None
+
+    latencies, errors, lock = [], [0], threading.Lock()
+    def worker(n):
+        key = f"s{n}"
+        for i in range(requests // threads):
+            t0 = time.perf_counter()
+            try:
+                session = db(db.bench_session.rkey == key).select().first()
+                if random.random() < read_ratio:
+                    if reader is not None:
+                        reader.on_request()
+                    try:
+                        db(db.bench_price).select(orderby=db.bench_price.symbol, limitby=(0, 20))
+                    finally:
+                        if reader is not None:
+                            reader.on_success()
+                else:
+                    db.bench_trade.insert(session_id=session.id, symbol=f"SYM{i % 100}", count=1)
+                db(db.bench_session.id == session.id).update(rvalue=json.dumps({'n': i}))
+                db.commit()
+            except Exception as e:
+                if 'locked' not in str(e):
+                    raise
+                db.rollback()
+                with lock:
+                    errors[0] += 1
+            with lock:
+                latencies.append(time.perf_counter() - t0)
+        db._adapter.close()
+
+    start = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    total = time.perf_counter() - start
+    if getattr(THREAD_LOCAL, db._adapter._connection_uname_, None) is not None:
+        db._adapter.close()
+    shutil.rmtree(folder, ignore_errors=True)
+    return {
+        'case': f"concurrency_{profile}",
+        'threads': threads,
+        'calls': len(latencies),
+        'read_ratio': read_ratio,
+        'throughput_per_s': round(len(latencies) / total, 2),
+        'latency_ms': latency_summary(latencies),
+        'locked_errors': errors[0],
+    }
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--companies", type=int, default=1000, help="N, number of companies")
+    parser.add_argument("--transactions", type=int, default=1000, help="M, transactions of the user")
+    parser.add_argument("--comments", type=int, default=200, help="K, comments on the post")
+    parser.add_argument("--reactions", type=int, default=10, help="max reactions per comment")
+    parser.add_argument("--users", type=int, default=50, help="users reacting to comments")
+    parser.add_argument("--repeat", type=int, default=20, help="timed calls per case")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the synthetic data")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    parser.add_argument("--threads", type=int, default=8, help="threads of the concurrency cases")
+    parser.add_argument("--concurrent-requests", type=int, default=800, help="requests per concurrency case")
+    parser.add_argument("--read-ratio", type=float, default=0.8, help="share of read-only concurrent requests")
+    parser.add_argument("--check-plans", action="store_true", help="only check the query plans")
+    args = parser.parse_args(argv)
+    random.seed(args.seed)
+
+    app = load_app()
+    if args.check_plans:
+        problems = app.models.check_query_plans()
+        print(json.dumps([{'query': name, 'plan': step} for name, step in problems], indent=2))
+        sys.exit(1 if problems else 0)
+    db = app.common.db
+    simulator = app.controllers.simulator
+    utilities = app.utilities
+    db._adapter.execution_handlers.append(QueryCounter)
+
+    company_ids, load_stats = seed_companies(app, simulator, args.companies)
+    user_ids = [seed_user(db, n) for n in range(max(1, args.users))]
+    seed_transactions(db, user_ids[0], company_ids, args.transactions)
+    utilities.rebuild_holdings(user_ids[0])
+    post_id = seed_comments(db, user_ids, args.comments, args.reactions)
+    utilities.reconcile_reaction_counts()
+    db.commit()
+
+    cases = [
+        ("load_companies", lambda: simulator.load_companies()),
+        ("load_companies_at_time", lambda: simulator.load_companies(simulator.get_time())),
+        ("get_portfolio", lambda: utilities.get_portfolio(user_ids[0], simulator)),
+        ("get_net_worth_history", lambda: utilities.get_net_worth_history(user_ids[0], simulator)),
+        ("get_post_comments", lambda: utilities.get_post_comments(post_id, user_ids[0])),
+    ]
+    results = {
+        'params': vars(args),
+        'python': platform.python_version(),
+        'timestamp': datetime.datetime.utcnow().isoformat(),
+        'company_loader': load_stats,
+        'cases': [run_case(name, fn, args.repeat) for name, fn in cases],
+        'concurrency': [concurrency_case(app, profile, args.threads, args.concurrent_requests, args.read_ratio)
+                        for profile in ("default", "concurrent")],
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,8 @@ from py4web.utils.tags import Tags
 from py4web.utils.factories import ActionFactory
 from py4web.utils.form import FormStyleBulma
 from . import settings
+from .ReaderPool import ReaderPool, apply_pragmas
+from .RequestMetrics import RequestMetrics
 
 # #######################################################
 # implement custom loggers form settings.LOGGERS
@@ -35,14 +37,40 @@ for item in settings.LOGGERS:
 # #######################################################
 # connect to db
 # #######################################################
+def storage_pragmas(profile):
+    """
+    Returns the SQLite pragmas of a settings.DB_STORAGE_PROFILE.
+    """
+    if profile != "concurrent":
+        return []
+    return [
+        "journal_mode=WAL",
+        "synchronous=NORMAL",
+        "busy_timeout=%d" % settings.DB_BUSY_TIMEOUT,
+        "mmap_size=%d" % settings.DB_MMAP_SIZE,
+        "cache_size=%d" % -settings.DB_CACHE_SIZE,
+    ]
+
+# WAL needs a database file, the profile does not apply to other databases
+db_pragmas = []
+if settings.DB_URI.startswith("sqlite://"):
+    db_pragmas = storage_pragmas(settings.DB_STORAGE_PROFILE)
+
 db = DAL(
     settings.DB_URI,
     folder=settings.DB_FOLDER,
     pool_size=settings.DB_POOL_SIZE,
     migrate=settings.DB_MIGRATE,
     fake_migrate=settings.DB_FAKE_MIGRATE,
+    after_connection=lambda adapter: apply_pragmas(adapter.connection, db_pragmas),
 )
 
+# Latency and SQL statements of the actions, made a prerequisite of db
+# (and so of db_reader) so that every action using the database is measured.
+metrics = RequestMetrics(db, settings.REQUEST_QUERY_BUDGET, logger)
+if settings.REQUEST_METRICS:
+    db.__prerequisites__ = (metrics,)
+
 # #######################################################
 # define global objects that may or may not be used by the actions
 # #######################################################
@@ -77,6 +105,15 @@ elif settings.SESSION_TYPE == "database":
 
     session = Session(secret=settings.SESSION_SECRET_KEY, storage=DBStore(db))
 
+# Fixture for the actions that only read: a pool of read-only connections
+# when the profile allows reads next to the writer, else db itself. It comes
+# after the session, which may be stored in db and is saved on every request.
+if db_pragmas:
+    db_reader = ReaderPool(db, settings.DB_READ_POOL_SIZE,
+                           [p for p in db_pragmas if not p.startswith("journal_mode")], session)
+else:
+    db_reader = db
+
 # #######################################################
 # Instantiate the object and actions that handle auth
 # #######################################################
@@ -25,31 +25,116 @@ session, db, T, auth, and tempates are examples of Fixtures.
 Warning: Fixtures MUST be declared with @action.uses({fixtures}) else your app will result in undefined behavior
 """
 
-from py4web import action, request, abort, redirect, URL
+import math
+from py4web import action, request, response, abort, redirect, URL
 from py4web.utils.form import Form, FormStyleBulma
 from yatl.helpers import A
-from .common import db, session, T, cache, auth, logger, authenticated, unauthenticated, flash
+from .common import db, db_reader, metrics, session, T, cache, auth, logger, authenticated, unauthenticated, flash
+from . import settings
+from py4web.core import dumps
 from py4web.utils.url_signer import URLSigner
-from .models import get_user_id, get_user_email, get_time
+from .models import get_user_id, get_user_email, get_time, check_query_plans
 from .StockSimulator import *
+from .PriceHistory import PriceHistory
+from .OrderQueue import OrderQueue
+from .OrderBook import MatchingEngine
+from .QuotePublisher import QuotePublisher
+from .ResponseCache import ResponseCache
+from .Leaderboard import Leaderboard
+from .CompanyLoader import CompanyLoader
 from .CompanyData import *
 
-from .utilities import get_portfolio, get_avg_bought_price, get_net_worth_history
+from .utilities import get_holding_rows, get_net_worth_history, get_post_comments
+from .utilities import rebuild_holdings, save_comment_reaction, reconcile_reaction_counts
 
 url_signer = URLSigner(session)
 
 # Get preset company data
-simulator = StockSimulator()
+simulator = StockSimulator(settings.SIMULATOR_TICK)
+if settings.SIMULATOR_TICK and settings.SIMULATOR_TICKER:
+    if settings.PRICE_HISTORY:
+        simulator.history = PriceHistory(settings.SIMULATOR_TICK, settings.PRICE_HISTORY_TICK_RETENTION)
+
+# Executes the buy and sell orders
+orders = OrderQueue(settings.ORDER_BATCH_SIZE, settings.ORDER_TIMEOUT)
+if settings.ORDER_QUEUE:
+    orders.start()
+
+# Fills the limit orders as the simulated prices move
+matching = MatchingEngine(orders)
+simulator.matching = matching
+matching.load()
+
+# Ranks the users by net worth, following the executed orders
+leaderboard = Leaderboard(simulator, settings.LEADERBOARD_SIZE)
+orders.leaderboard = leaderboard
+
+# Encoded responses of the read endpoints, shared by every viewer
+# until the next tick
+response_cache = ResponseCache(simulator, settings.RESPONSE_CACHE_BUDGET)
+
+# Returns the JSON text of compute(), from response_cache when the same
+# endpoint was called with the same args during the current tick
+def cached_json(endpoint, args, compute):
+    response.headers['Content-Type'] = 'application/json'
+    return response_cache.get(endpoint, args, lambda: dumps(compute()))
+
+# Pushes the quotes to the company and search pages
+publisher = QuotePublisher(simulator)
 
 # redirects user to index page if not logged in
 def ensure_login():
     auth.get_user() or redirect(URL(''))
 
+# Only the users of settings.ADMIN_EMAILS may go on
+def ensure_admin():
+    ensure_login()
+    if (auth.get_user().get('email') or '').lower() not in settings.ADMIN_EMAILS:
+        abort(403)
+
+# Reads the companies of settings.COMPANY_FILE
+company_loader = CompanyLoader(settings.COMPANY_LOAD_CHUNK)
+
+# Reseeds the companies from scratch, deleting every transaction.
+# Returns the rows loaded per second from settings.COMPANY_FILE.
 @action('load_db')
 @action.uses(db)
 def load_db():
-    simulator.initialize_database(preset_companies())
-load_db()
+    if settings.COMPANY_FILE:
+        stats = company_loader.load(simulator, settings.COMPANY_FILE)
+    else:
+        simulator.initialize_database(preset_companies())
+        stats = dict(rows=len(preset_companies()))
+    leaderboard.invalidate()
+    return stats
+
+# Only writes the companies that are missing, changed or gone, reading
+# settings.COMPANY_FILE one chunk at a time
+if simulator.seed_database(company_loader.read(settings.COMPANY_FILE) if settings.COMPANY_FILE
+                           else preset_companies(), settings.COMPANY_LOAD_CHUNK):
+    leaderboard.invalidate()
+
+# Warn about the hot queries that are not covered by an index
+if db._dbname == 'sqlite':
+    for name, step in check_query_plans():
+        logger.warning(f'Query "{name}" does not use an index: {step}')
+
+# Fill the holdings ledger from the transactions made before it existed
+if db(db.holding).isempty() and not db(db.transaction).isempty():
+    rebuild_holdings()
+    db.commit()
+
+# Fill the reaction counters of the comments made before they existed
+if not db(db.forum_comment.likes == None).isempty():
+    reconcile_reaction_counts()
+    db.commit()
+
+# The threads pricing the ticks start once the companies are seeded
+simulator.registry.ensure_loaded()
+if settings.SIMULATOR_TICK and settings.SIMULATOR_TICKER:
+    simulator.start_ticker()
+if settings.SIMULATOR_TICK:
+    publisher.start()
 
 
 ##############
@@ -71,7 +156,7 @@ def index():
 
 # returns True if the email is already in the auth_user table
 @action('verify_email')
-@action.uses(db)
+@action.uses(db_reader)
 def verify_email():
     email = request.params.get('email')
     user = db(db.auth_user.email == email).select().first()
@@ -100,7 +185,7 @@ def init_user():
 #####################
 
 @action('portfolio')
-@action.uses('portfolio.html', db, auth, url_signer)
+@action.uses('portfolio.html', db_reader, auth, url_signer)
 def portfolio():
     ensure_login()
     return {'get_holdings_url' : URL('get_holdings'),
@@ -110,21 +195,14 @@ def portfolio():
             'get_transactions_url' : URL('get_transactions')}
 
 @action('get_holdings')
-@action.uses(db, auth)
+@action.uses(db_reader, auth)
 def get_holdings():
     ensure_login()
     user_id = auth.get_user().get('id')
-    holdings = get_portfolio(user_id, simulator)['holdings']
-    holdings = [{'company_name' : (c := db.company[k]).company_name, 
-                 'company_id' : k,
-                 'symbol' : c.company_symbol,
-                 'shares' : v,
-                 'price' : round(simulator.load_company(c.company_symbol)['current_stock_value'], 2),
-                 'bought_price' : round(get_avg_bought_price(user_id, k), 2)} for k,v in holdings.items()]
-    return {'holdings' : holdings}
+    return {'holdings' : get_holding_rows(user_id, simulator)}
 
 @action('get_user_info')
-@action.uses(db, auth)
+@action.uses(db_reader, auth)
 def get_user_info():
     ensure_login()
     user_id = auth.get_user().get('id')
@@ -150,26 +228,71 @@ def update_user_profile():
         db(db.user.user_id == id).update(pfp=pfp)
     return 'OK'
 
+# The optional steps and minutes parameters set the number of points
+# of the curve and the length of the window it covers.
+# steps is clamped between 2 and net_worth_max_steps, minutes like the
+# minutes of get_stock_history.
+net_worth_max_steps = 1000
 @action('get_net_worth', method='POST')
-@action.uses(db, auth)
+@action.uses(db_reader, auth)
 def get_net_worth():
+    import datetime
+    ensure_login()
     id = auth.get_user()['id']
-    history, dates = get_net_worth_history(id, simulator)
+    try:
+        steps = int(request.params.get('steps', 30))
+        minutes = float(request.params.get('minutes', 5))
+    except ValueError:
+        abort(400, 'Invalid steps or minutes')
+    steps = min(max(steps, 2), net_worth_max_steps)
+    # NaN falls back to the default window
+    minutes = min(max(minutes, 1), history_max_minutes) if minutes == minutes else 5.0
+    start_time = datetime.datetime.utcnow() - datetime.timedelta(minutes=minutes)
+    history, dates = get_net_worth_history(id, simulator, start_time, steps)
     return {'history' : history, 'dates' : dates}
 
+# Returns a page of the user's transactions, newest first.
+# Optional JSON parameters: cursor (the next_cursor of the previous page),
+# size, symbol, and start and end dates (ISO format).
+transactions_page_size = 50
 @action('get_transactions', method='POST')
-@action.uses(db, auth)
+@action.uses(db_reader, auth)
 def get_transactions():
+    import datetime
     ensure_login()
     user_id = auth.get_user()['id']
-    transactions = db(db.transaction.user_id == user_id).select(orderby=db.transaction.transaction_date)
+    params = request.json or {}
+    query = (db.transaction.user_id == user_id) & (db.transaction.company_id == db.company.id)
+    if params.get('symbol'):
+        query &= db.company.company_symbol == params['symbol']
+    try:
+        size = min(max(int(params.get('size', transactions_page_size)), 1), 500)
+        if params.get('start'):
+            query &= db.transaction.transaction_date >= datetime.datetime.fromisoformat(params['start'])
+        if params.get('end'):
+            query &= db.transaction.transaction_date <= datetime.datetime.fromisoformat(params['end'])
+        if params.get('cursor'):
+            date, t_id = params['cursor'].rsplit(',', 1)
+            date = datetime.datetime.fromisoformat(date)
+            query &= ((db.transaction.transaction_date < date) |
+                      ((db.transaction.transaction_date == date) & (db.transaction.id < int(t_id))))
+    except (AttributeError, TypeError, ValueError, OverflowError):
+        abort(400, 'Invalid size, dates or cursor')
+    rows = db(query).select(
+        db.transaction.id, db.transaction.transaction_type, db.transaction.count,
+        db.transaction.value_per_share, db.transaction.transaction_date, db.company.company_name,
+        orderby=~db.transaction.transaction_date|~db.transaction.id,
+        limitby=(0, size + 1))
     ret = []
-    for t in transactions:
-        company = db.company[t.company_id].company_name
-        desc = f'{"Bought" if t.transaction_type == "buy" else "Sold"} {t.count} shares of {company} for {t.value_per_share}'
-        date = str(t.transaction_date)
-        ret.append({'desc' : desc, 'date' : date})
-    return {'transactions' : list(reversed(ret))}
+    for r in rows[:size]:
+        t = r.transaction
+        desc = f'{"Bought" if t.transaction_type == "buy" else "Sold"} {t.count} shares of {r.company.company_name} for {t.value_per_share}'
+        ret.append({'desc' : desc, 'date' : str(t.transaction_date)})
+    next_cursor = None
+    if len(rows) > size:
+        last = rows[size - 1].transaction
+        next_cursor = f'{last.transaction_date.isoformat()},{last.id}'
+    return {'transactions' : ret, 'next_cursor' : next_cursor}
 
 
 #################
@@ -180,7 +303,7 @@ def get_transactions():
 # If no id, choose the first one in the db.
 @action('company')
 @action('company/<id:int>')
-@action.uses('company.html', db, auth, url_signer)
+@action.uses('company.html', db_reader, auth, url_signer)
 def company(id=None):
     ensure_login()
     return dict(
@@ -189,30 +312,52 @@ def company(id=None):
         get_user_info_url=URL('get_user_info'),
         buy_shares_url=URL('buy_shares', signer=url_signer),
         sell_shares_url=URL('sell_shares', signer=url_signer),
+        order_status_url=URL('order_status'),
         get_holdings_url=URL('get_holdings'),
+        stream_quotes_url=URL('stream_quotes'),
     )
 
 # reloads the company data and sends it to the company page
 @action('load_company')
-@action.uses(db)
+@action.uses(db_reader)
 def load_company():
-    co_symbol = request.params.get('co_symbol')
+    args = (request.params.get('co_symbol'), request.params.get('co_id'))
+    return cached_json('load_company', args, lambda: company_quote(*args))
+
+def company_quote(co_symbol, co_id):
     if co_symbol == None:
         # get symbol from db
-        co_id = int(request.params.get('co_id'))
+        co_id = int(co_id)
         assert isinstance(co_id, int)
         if co_id < 0:
             # get first company in db
-            comp = db(db.company).select().first()
+            comp = simulator.registry.first()
         else:
             # match company with id
-            comp = db.company[co_id]
+            comp = simulator.registry.get(co_id)
         assert comp != None
         co_symbol = comp['company_symbol']
 
     # Get company info from db
     return load_company_data(co_symbol)
 
+# Server-Sent Events stream of the quotes of the comma separated symbols
+# in co_symbol, one quote event per symbol and tick.
+# Run py4web with an async server (--server gevent) for many subscribers,
+# a threaded server holds one thread per open stream.
+quote_stream_max_symbols = 200
+@action('stream_quotes')
+@action.uses(db_reader)
+def stream_quotes():
+    symbols = [s for s in request.params.get('co_symbol', '').split(',') if s]
+    symbols = [s for s in symbols[:quote_stream_max_symbols] if simulator.registry.index(s) is not None]
+    if not symbols:
+        abort(404)
+    response.headers['Content-Type'] = 'text/event-stream'
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return publisher.stream(symbols)
+
 # Loads data relevant to the company matching the symbol
 def load_company_data(symbol):
     my_company = simulator.load_company(symbol)
@@ -234,98 +379,252 @@ def load_company_data(symbol):
         date=current_date,
     )
 
+# Orders go through the order queue, which checks the balance and the
+# holdings and applies them one at a time, at the current simulated price
+# whatever the price the page shows. Rejected orders return the reason in
+# error.
 @action('buy_shares', method="POST")
 @action.uses(db, auth, url_signer.verify())
 def buy_shares():
-    num_shares = request.json.get('num_shares')
-    co_id = request.json.get('co_id')
-    value = request.json.get('price')
-    transaction = db.transaction.insert(
-        company_id=co_id,
-        transaction_type='buy',
-        count=num_shares,
-        value_per_share=value,
-    )
-    # Update balance
-    user_id = get_user_id()
-    user = db(db.user.user_id == user_id).select().first()
-    new_balance = round(user.user_balance - float(value) * int(num_shares), 2)
-    db(db.user.user_id == user_id).update(user_balance=new_balance)
-    return dict(balance=new_balance)
+    return submit_order('buy')
 
 
 @action('sell_shares', method="POST")
 @action.uses(db, auth, url_signer.verify())
 def sell_shares():
-    num_shares = request.json.get('num_shares')
-    co_id = request.json.get('co_id')
-    value = request.json.get('price')
-    transaction = db.transaction.insert(
-        company_id=co_id,
-        transaction_type='sell',
-        count=num_shares,
-        value_per_share=value,
-    )
-    # Update balance
+    return submit_order('sell')
+
+def submit_order(transaction_type):
     user_id = get_user_id()
-    user = db(db.user.user_id == user_id).select().first()
-    new_balance = round(user.user_balance + float(value) * int(num_shares), 2)
-    db(db.user.user_id == user_id).update(user_balance=new_balance)
-    return dict(balance=new_balance)
+    try:
+        num_shares = int(request.json.get('num_shares'))
+        co_id = int(request.json.get('co_id'))
+    except (TypeError, ValueError, OverflowError):
+        abort(400, 'Invalid company or number of shares')
+    if simulator.registry.index(co_id) is None:
+        abort(404)
+    value = float(simulator.current_prices([co_id])[0])
+    try:
+        return order_result(user_id, orders.submit(user_id, co_id, transaction_type, num_shares, value))
+    except ValueError as e:
+        return order_result(user_id, dict(error=str(e)))
+
+# Adds the current balance of the user to the result of an order that is
+# pending or was rejected.
+def order_result(user_id, result):
+    if 'balance' not in result:
+        user = db(db.user.user_id == user_id).select(db.user.user_balance).first()
+        result = dict(result, balance=user.user_balance if user else 0)
+    return result
+
+# Returns the result of an order submit_order left pending, or pending
+# again while it is still queued.
+@action('order_status')
+@action.uses(db_reader, auth)
+def order_status():
+    user_id = get_user_id()
+    try:
+        order_id = int(request.params.get('order_id'))
+    except (TypeError, ValueError):
+        abort(400, 'Invalid order id')
+    try:
+        result = orders.poll(user_id, order_id)
+    except ValueError as e:
+        result = dict(error=str(e))
+    if result is None:
+        abort(404)
+    return order_result(user_id, result)
+
+# Places a limit order, filled at the simulated price once it reaches
+# limit_price: at or below it for buys, at or above it for sells.
+@action('place_order', method="POST")
+@action.uses(db, auth, url_signer.verify())
+def place_order():
+    side = request.json.get('side')
+    try:
+        co_id = int(request.json.get('co_id'))
+        num_shares = int(request.json.get('num_shares'))
+        limit_price = float(request.json.get('limit_price'))
+    except (TypeError, ValueError, OverflowError):
+        abort(400, 'Invalid company, number of shares or limit price')
+    if side not in ('buy', 'sell') or num_shares <= 0 or not (math.isfinite(limit_price) and limit_price > 0):
+        abort(400)
+    if simulator.registry.index(co_id) is None:
+        abort(404)
+    price = float(simulator.current_prices([co_id])[0])
+    order_id = matching.place(get_user_id(), co_id, side, num_shares, limit_price, price)
+    return dict(order=db.limit_order(order_id).as_dict())
+
+@action('cancel_order', method="POST")
+@action.uses(db, auth, url_signer.verify())
+def cancel_order():
+    try:
+        order_id = int(request.json.get('order_id'))
+    except (TypeError, ValueError, OverflowError):
+        abort(400, 'Invalid order id')
+    return dict(cancelled=matching.cancel(get_user_id(), order_id))
+
+# Returns the open limit orders of the user, and the 50 latest closed ones
+@action('get_orders')
+@action.uses(db_reader, auth)
+def get_orders():
+    user_id = get_user_id()
+    open_orders = db((db.limit_order.user_id == user_id) & (db.limit_order.status == 'open')).select(
+        orderby=db.limit_order.id)
+    closed_orders = db((db.limit_order.user_id == user_id) & (db.limit_order.status != 'open')).select(
+        orderby=~db.limit_order.id, limitby=(0, 50))
+    return dict(open_orders=open_orders.as_list(), closed_orders=closed_orders.as_list())
 
 
 # Return the history of a company to graph
-# currently set to return latest five minutes
+# by default set to return latest five minutes, the minutes
+# parameter asks for a longer window.
+# co_symbol may hold several comma separated symbols, in which case
+# every series is returned in stock_histories, keyed by symbol.
+# With since, the epoch milliseconds of the last point the client has,
+# see stock_history_since.
+# minutes is clamped between 1 and a year
+history_max_minutes = 60 * 24 * 365
 @action('get_stock_history')
-@action.uses(db)
+@action.uses(db_reader)
 def get_stock_history():
+    try:
+        minutes = float(request.params.get('minutes', 5))
+        since = request.params.get('since')
+        since = None if since is None else int(since)
+    except ValueError:
+        abort(400, 'Invalid minutes or since')
+    # NaN falls back to the default window
+    minutes = min(max(minutes, 1), history_max_minutes) if minutes == minutes else 5.0
+    args = (request.params.get('co_symbol'), minutes, since)
+    return cached_json('get_stock_history', args, lambda: stock_history(*args))
+
+def stock_history(co_symbol, minutes, since):
     import datetime
-    # Load given company
-    co_symbol = request.params.get('co_symbol')
-    # Get stock history
-    hist = []
-    times = []
+    # Load given companies
+    co_symbols = co_symbol.split(',')
     # We will do 30 steps from start up time to current time by default
     steps = 30
-    minutes = 5
     duration = 60 * minutes
+    simulator.update_current_time()
+    if since is not None:
+        return stock_history_since(co_symbols, minutes, steps, since)
     start_time = simulator.current_time - datetime.timedelta(seconds=duration)
 
-    
-    for i in range(steps + 1):
-        times.append(start_time + datetime.timedelta(seconds = i * duration // steps))
-    for t in times:
-        co = simulator.load_company(co_symbol, t)
-        hist.append(co['current_stock_value'])
+    # Windows over an hour are read from the stored rollups when
+    # they cover them, rather than sampled from the formula.
+    if simulator.history is not None and minutes > 60:
+        histories = stored_stock_history(co_symbols, start_time, simulator.current_time)
+        if histories is not None:
+            return histories
+
+    times = [start_time + datetime.timedelta(seconds = i * duration // steps) for i in range(steps + 1)]
+    # Get stock history
+    histories = simulator.price_series(co_symbols, times)
     return dict(
-        stock_history=hist,
+        stock_history=histories.get(co_symbols[0]),
+        stock_histories=histories,
         dates=times,
     )
 
+# Returns only the points of the window newer than since, in compact form:
+# times holds epoch milliseconds and the series are plain number arrays.
+# The points are sampled on a grid aligned to the step rather than to the
+# current time, so that they do not move from one call to the next and
+# the client can append them. since=0 returns the whole window.
+def stock_history_since(co_symbols, minutes, steps, since):
+    end_time = simulator.current_time
+    end = simulator.to_epoch_ms(end_time)
+    start = max(since + 1, end - int(60000 * minutes))
+    if simulator.history is not None and minutes > 60:
+        histories = stored_stock_history(co_symbols, simulator.from_epoch_ms(start), end_time)
+        if histories is not None:
+            return dict(
+                times=[simulator.to_epoch_ms(t) for t in histories['dates']],
+                stock_history=histories['stock_history'],
+                stock_histories=histories['stock_histories'],
+            )
+    step = max(int(60000 * minutes) // steps, 1)
+    times = list(range(-(-start // step) * step, end + 1, step))
+    histories = simulator.price_series(co_symbols, [simulator.from_epoch_ms(t) for t in times])
+    return dict(
+        times=times,
+        stock_history=histories.get(co_symbols[0]),
+        stock_histories=histories,
+    )
+
+# Reads the history of the companies from the price history store.
+# Returns None if the store has less than two points for the first one,
+# or if they start after start_time and so do not cover the window.
+def stored_stock_history(co_symbols, start_time, end_time):
+    companies = [c for c in map(simulator.registry.get, co_symbols) if c is not None]
+    series = simulator.history.series([c['id'] for c in companies], start_time, end_time)
+    histories = {c['company_symbol']: series[c['id']] for c in companies}
+    first = histories.get(co_symbols[0])
+    if first is None or len(first[1]) < 2 or first[0][0] > start_time:
+        return None
+    return dict(
+        stock_history=first[1],
+        stock_histories={s: h[1] for s, h in histories.items()},
+        dates=first[0],
+    )
+
 
 ###################
 # Search
 ###################
 
 @action('search')
-@action.uses('search.html', db, auth)
+@action.uses('search.html', db_reader, auth)
 def search():
     ensure_login()
     return dict(
         search_data_url = URL('search_data'), 
         company_url = URL('company'),
         get_history_url = URL('get_stock_history'),
+        stream_quotes_url = URL('stream_quotes'),
     )
 
+# Returns the k best matches of the query q among the company names and
+# symbols, priced. An empty query returns the first k companies.
+search_max_results = 100
 @action('search_data')
-@action.uses(db, auth)
+@action.uses(db_reader, auth)
 def search_data():
-    company_rows = []
-    simulator_data = simulator.load_companies()
-    for key in simulator_data:
-        company_rows.append(simulator_data[key])
-    
-    return dict(company_rows = company_rows)
+    query = request.params.get('q', '').strip().lower()
+    try:
+        k = min(max(int(request.params.get('k', 20)), 1), search_max_results)
+    except ValueError:
+        abort(400, 'Invalid k')
+    return cached_json('search_data', (query, k), lambda: search_companies(query, k))
+
+def search_companies(query, k):
+    state, idx = simulator.search_index.find(query, k)
+    return dict(company_rows = simulator.quote_companies(idx, state))
+
+
+#################################
+# Leaderboard
+#################################
+
+@action('leaderboard')
+@action.uses('leaderboard.html', db_reader, auth)
+def leaderboard_page():
+    ensure_login()
+    return dict(get_leaderboard_url = URL('get_leaderboard'))
+
+# Returns page page (from 0) of the net worth ranking, size users per page
+leaderboard_max_page_size = 100
+@action('get_leaderboard')
+@action.uses(db_reader, auth)
+def get_leaderboard():
+    ensure_login()
+    try:
+        page = max(int(request.params.get('page', 0)), 0)
+        size = min(max(int(request.params.get('size', 25)), 1), leaderboard_max_page_size)
+    except ValueError:
+        abort(400, 'Invalid page or size')
+    return cached_json('get_leaderboard', (page, size), lambda: leaderboard.page(page, size))
 
 
 #################################
@@ -334,7 +633,7 @@ def search_data():
 
 # Displays forum topics
 @action('forum')
-@action.uses('forum.html', db, auth)
+@action.uses('forum.html', db_reader, auth)
 def forum():
     ensure_login()
     # query forum_topic db for topics in alphabetical order
@@ -360,10 +659,14 @@ def forum_add_topic():
         form=form,
     )
 
-# Displays posts within a category
+# Displays posts within a category, newest first, a page at a time.
+# The before parameter is the cursor of the last post of the previous
+# page, size the number of posts per page.
+forum_page_size = 20
 @action('forum/<topic_id:int>')
-@action.uses('forum_topic.html', db, auth)
+@action.uses('forum_topic.html', db_reader, auth)
 def forum_topic(topic_id = None):
+    import datetime
     ensure_login()
     assert topic_id != None
 
@@ -371,30 +674,53 @@ def forum_topic(topic_id = None):
     topic = db.forum_topic[topic_id]
     assert topic != None
 
-    # get the posts related to this topic in chronological order
-    posts = db(db.forum_post.topic_id == topic_id).select(orderby=db.forum_post.post_date).as_list()
-    posts.reverse()
-
-    # go through and add the user names to each post
-    for post_id in range(len(posts)):
-        post = posts[post_id]
-        user = db.auth_user[post['user_id']]
-        if user == None:
-            name = "unknown"
+    query = db.forum_post.topic_id == topic_id
+    before = request.params.get('before')
+    try:
+        size = min(max(int(request.params.get('size', forum_page_size)), 1), 100)
+        if before:
+            date, post_id = before.rsplit(',', 1)
+            date = datetime.datetime.fromisoformat(date)
+            query &= ((db.forum_post.post_date < date) |
+                      ((db.forum_post.post_date == date) & (db.forum_post.id < int(post_id))))
+    except ValueError:
+        abort(400, 'Invalid size or before')
+
+    # get a page of posts related to this topic in reverse chronological
+    # order, with the user names, plus one to know if there is a next page
+    rows = db(query).select(
+        db.forum_post.ALL, db.auth_user.first_name, db.auth_user.last_name,
+        left=db.auth_user.on(db.auth_user.id == db.forum_post.user_id),
+        orderby=~db.forum_post.post_date|~db.forum_post.id,
+        limitby=(0, size + 1))
+    posts = []
+    for row in rows[:size]:
+        post = row.forum_post.as_dict()
+        user = row.auth_user
+        if user.first_name == None:
+            post['name'] = "unknown"
         else:
-            name = user['first_name'] + ' ' + user['last_name']
-        posts[post_id]['name'] = name
+            post['name'] = user.first_name + ' ' + user.last_name
+        posts.append(post)
+
+    next_url = None
+    if len(rows) > size:
+        last = posts[-1]
+        next_url = URL('forum', topic_id, vars=dict(
+            before=f"{last['post_date'].isoformat()},{last['id']}", size=size))
 
     return dict(
         topic_id=topic_id,
         topic=topic['topic'],
         posts=posts,
+        next_url=next_url,
+        first_url=URL('forum', topic_id, vars=dict(size=size)) if before else None,
     )
 
 
 # Displays individual post with comments
 @action('forum_post/<post_id:int>')
-@action.uses('forum_post.html', db, auth, url_signer)
+@action.uses('forum_post.html', db_reader, auth, url_signer)
 def forum_post(post_id = None):
     ensure_login()
     assert post_id is not None
@@ -469,7 +795,7 @@ def forum_delete_post(post_id=None):
 #######################################
 
 @action('get_post/<post_id:int>')
-@action.uses(db, auth)
+@action.uses(db_reader, auth)
 def get_post(post_id = None):
     assert post_id != None
     post = db.forum_post[post_id]
@@ -482,56 +808,12 @@ def get_post(post_id = None):
 
 
 @action('get_comments/<post_id:int>')
-@action.uses(db, auth, url_signer.verify())
+@action.uses(db_reader, auth, url_signer.verify())
 def get_comments(post_id = None):
     assert post_id is not None
     current_user = db(db.auth_user.email == get_user_email()).select().first()
     assert current_user is not None
-    # Get comments
-    all_entries = db(db.forum_comment.post_id == post_id).select().as_list()
-    # Add owner name and email to each comment
-    # Also add the number of likers and dislikers to comments
-    # Also find the replies parented to each comment
-    comments = []
-    reply_dict = {}
-    for c in all_entries:
-        user = db(db.auth_user.id == c['user_id']).select().first()
-        c['user_name'] = user.first_name + " " +user.last_name
-        c['user_email'] = user.email
-        # Get reactions to the comment
-        reactions = db(db.reaction_comment.comment_id == c['id']).select()
-        # Sum likes and dislikes
-        likes = 0
-        dislikes = 0
-        for r in reactions:
-            if r.reaction == 1:
-                likes += 1
-            elif r.reaction == -1:
-                dislikes += 1
-        # Add to comment
-        c['likes'] = likes
-        c['dislikes'] = dislikes
-        # Current user reaction
-        current_reaction = db((db.reaction_comment.comment_id == c['id']) &
-            (db.reaction_comment.user_id == current_user.id)).select().first()
-        if current_reaction:
-            c['reaction'] = current_reaction.reaction
-        else:
-            c['reaction'] = 0
-        # If this is has a parent, add it to the reply dict
-        # otherwise, it is a top level comment
-        if c['parent_idx'] == -1:
-            comments.append(c)
-        else:
-            reply_list = reply_dict.get(c['parent_idx'], [])
-            reply_dict[c['parent_idx']] = reply_list + [c]
-        
-    # Connect the replies to the comments
-    for c in comments:
-        c['reply_list'] = reply_dict.get(c['id'], [])
-
-    # Sort comments by likes-dislikes
-    comments = sorted(comments, key=lambda c: c['likes']-c['dislikes'], reverse=True)
+    comments = get_post_comments(post_id, current_user.id)
     # Return user name of the current user as well
     return dict(
         comments=comments,
@@ -550,13 +832,7 @@ def save_reaction():
     if comment is None:
         return "Save Failed, Comment Not Found."
     # else: Insert or update the reaction
-    db.reaction_comment.update_or_insert(
-        ((db.reaction_comment.comment_id == comment_id) & 
-        (db.reaction_comment.user_id == user.id)),
-        comment_id = comment_id,
-        user_id = user.id,
-        reaction = reaction,
-    )
+    save_comment_reaction(comment_id, user.id, reaction)
     return "ok"
 
 @action('post_comment/<post_id:int>', method="POST")
@@ -616,9 +892,40 @@ def delete_comment():
 @action('admin', method=['GET', 'POST'])
 @action.uses('admin.html', db, auth)
 def admin():
+    ensure_admin()
     if request.json:
         action = request.json.get('action')
         if action == 'dump_transactions':
+            db.holding.truncate()
             db.transaction.truncate()
+            leaderboard.invalidate()
+            print('DONE')
+        elif action == 'rebuild_holdings':
+            rebuild_holdings()
+            leaderboard.invalidate()
+            print('DONE')
+        elif action == 'reconcile_reactions':
+            reconcile_reaction_counts()
+            print('DONE')
+        elif action == 'clear_cache':
+            response_cache.invalidate()
+            print('DONE')
+        elif action == 'reset_metrics':
+            metrics.reset()
             print('DONE')
-    return {'admin_url' : URL('admin')}
\ No newline at end of file
+    return {'admin_url' : URL('admin'), 'cache_stats_url' : URL('cache_stats'),
+            'request_metrics_url' : URL('request_metrics')}
+
+# Hit, miss and eviction counters of the response cache
+@action('cache_stats')
+@action.uses(db_reader, auth)
+def cache_stats():
+    ensure_admin()
+    return response_cache.stats()
+
+# Latency histograms and SQL statement counts of the actions
+@action('request_metrics')
+@action.uses(db_reader, auth)
+def request_metrics():
+    ensure_admin()
+    return metrics.stats()
\ No newline at end of file
@@ -3,7 +3,7 @@ This file defines the database models
 """
 
 import datetime
-from .common import db, Field, auth
+from .common import db, Field, auth, logger
 from pydal.validators import *
 
 def get_user_id():
@@ -45,6 +45,20 @@ db.define_table(
     Field('latest_update', 'datetime', default=get_time),
 )
 
+# Price history of the companies, written by the simulator ticker.
+# resolution is the bucket length in seconds, 0 for raw ticks which
+# only hold close_value.
+db.define_table(
+    'stock_history',
+    Field('company_id', 'reference company'),
+    Field('resolution', 'integer', default=0),
+    Field('bucket_time', 'datetime'),
+    Field('open_value', 'float'),
+    Field('high_value', 'float'),
+    Field('low_value', 'float'),
+    Field('close_value', 'float'),
+)
+
 # Transaction table to hold info about all the transactions taking place
 # We can see what a user owns by iterating through transactions and noting
 # what they currently have and what they used to have.
@@ -58,6 +72,38 @@ db.define_table(
     Field('transaction_date', 'datetime', default=get_time)
 )
 
+# Holdings ledger, maintained from the transactions as they are made so
+# that a portfolio does not need to replay the whole transaction history.
+# cost_basis is the average cost of the shares still held, bought_value
+# and sold_value the totals of all buys and sells of the company.
+db.define_table(
+    'holding',
+    Field('user_id', 'reference auth_user'),
+    Field('company_id', 'reference company'),
+    Field('shares', 'float', default=0.),
+    Field('cost_basis', 'float', default=0.),
+    Field('realized_pnl', 'float', default=0.),
+    Field('bought_value', 'float', default=0.),
+    Field('sold_value', 'float', default=0.),
+)
+
+# Limit orders, resting in the order books of the matching engine while
+# open and filled at the simulated price once it reaches limit_price.
+# status is one of open, filled, cancelled or rejected (the fill failed
+# the balance or holdings check).
+db.define_table(
+    'limit_order',
+    Field('user_id', 'reference auth_user', default=get_user_id),
+    Field('company_id', 'reference company'),
+    Field('side', requires=IS_IN_SET(['buy', 'sell'])),
+    Field('count', 'float', requires=IS_FLOAT_IN_RANGE(0, None)),
+    Field('limit_price', 'float', requires=IS_FLOAT_IN_RANGE(0, None)),
+    Field('status', default='open'),
+    Field('fill_price', 'float'),
+    Field('created', 'datetime', default=get_time),
+    Field('filled', 'datetime'),
+)
+
 # Table to hold the forum topics
 db.define_table(
     'forum_topic',
@@ -84,7 +130,11 @@ db.define_table(
     Field('post_id', 'reference forum_post'),
     Field('parent_idx', 'integer', default=-1), # Not a reference since it can be empty
     Field('comment', requires=IS_NOT_EMPTY()),
-    Field('comment_date', 'datetime', default=get_time)
+    Field('comment_date', 'datetime', default=get_time),
+    # Counts of the reaction_comment rows of this comment, kept up to
+    # date by save_reaction and recomputed by reconcile_reaction_counts
+    Field('likes', 'integer', default=0),
+    Field('dislikes', 'integer', default=0),
 )
 
 # Table to hold reactions to comments
@@ -101,4 +151,126 @@ db.define_table(
 # TODO: Make fields unreadable and unwritable if they would appear in forms...
 
 
+# Secondary indexes of the tables above, as
+# name: (table, fields, unique)
+# They are created at startup if they do not exist yet.
+INDEXES = {
+    'company_symbol_idx': ('company', ('company_symbol',), True),
+    'user_user_id_idx': ('user', ('user_id',), False),
+    'stock_history_company_idx': ('stock_history', ('company_id', 'resolution', 'bucket_time'), False),
+    'stock_history_resolution_idx': ('stock_history', ('resolution', 'bucket_time'), False),
+    'transaction_user_date_idx': ('transaction', ('user_id', 'transaction_date'), False),
+    'holding_user_company_idx': ('holding', ('user_id', 'company_id'), True),
+    'limit_order_status_idx': ('limit_order', ('status', 'company_id'), False),
+    'limit_order_user_idx': ('limit_order', ('user_id', 'status'), False),
+    'forum_post_topic_date_idx': ('forum_post', ('topic_id', 'post_date'), False),
+    'forum_comment_post_idx': ('forum_comment', ('post_id',), False),
+    'forum_comment_parent_idx': ('forum_comment', ('parent_idx',), False),
+    'reaction_comment_comment_user_uidx': ('reaction_comment', ('comment_id', 'user_id'), True),
+}
+
+# Indexes replaced by one of INDEXES, dropped at startup
+DROPPED_INDEXES = ('reaction_comment_comment_user_idx',)
+
+def create_indexes():
+    """
+    Create the missing indexes of INDEXES, safe to run on every start.
+    Before creating a unique index, the rows that would break it are
+    logged and deleted, keeping the latest of each, unless other tables
+    reference the table: deleting them would cascade to the rows
+    referencing them, so RuntimeError is raised instead and the duplicates
+    are left to be merged by hand. Returns the tables that had duplicates.
+    """
+    for name in DROPPED_INDEXES:
+        db.executesql('DROP INDEX IF EXISTS %s;' % name)
+    deduplicated = []
+    for name, (table, fields, unique) in INDEXES.items():
+        if unique and not index_exists(name):
+            columns = ', '.join(db[table][f]._rname for f in fields)
+            duplicates = db.executesql('SELECT %s, COUNT(*) FROM %s GROUP BY %s HAVING COUNT(*) > 1;' % (
+                columns, db[table]._rname, columns))
+            if duplicates and db[table]._referenced_by:
+                logger.error(f'Duplicate {table} rows {fields} and counts: {duplicates[:20]}')
+                raise RuntimeError(f'{table} has rows with the same {", ".join(fields)}, merge them '
+                                   f'before the unique index {name} can be created')
+            if duplicates:
+                logger.warning(f'Deleting the older duplicate {table} rows {fields} and counts: {duplicates[:20]}')
+                db.executesql('DELETE FROM %s WHERE %s NOT IN (SELECT MAX(%s) FROM %s GROUP BY %s);' % (
+                    db[table]._rname, db[table]._id._rname, db[table]._id._rname, db[table]._rname, columns))
+                deduplicated.append(table)
+        db.executesql('CREATE %sINDEX IF NOT EXISTS %s ON %s (%s);' % (
+            'UNIQUE ' if unique else '', name, db[table]._rname,
+            ', '.join(db[table][f]._rname for f in fields)))
+    return deduplicated
+
+def index_exists(name):
+    """
+    Whether the index exists, only known for SQLite, False elsewhere.
+    """
+    if db._dbname != 'sqlite':
+        return False
+    return bool(db.executesql("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = '%s';" % name))
+
+def hot_queries():
+    """
+    Returns (name, sql) for the queries the app runs on every page load,
+    with placeholder ids, as checked by check_query_plans.
+    """
+    return [
+        ('company by symbol', db(db.company.company_symbol == 'AAPL')._select()),
+        ('user balance', db(db.user.user_id == 1)._select()),
+        ('transactions of user', db(db.transaction.user_id == 1)._select(
+            orderby=db.transaction.transaction_date)),
+        ('transactions page', db((db.transaction.user_id == 1) & (db.transaction.company_id == db.company.id))._select(
+            db.transaction.ALL, db.company.company_name,
+            orderby=~db.transaction.transaction_date|~db.transaction.id, limitby=(0, 51))),
+        ('holding of user', db((db.holding.user_id == 1) & (db.holding.company_id == 1))._select()),
+        ('holdings of user', db((db.holding.user_id == 1) & (db.holding.shares > 0)
+                                & (db.holding.company_id == db.company.id))._select(
+            db.holding.ALL, db.company.company_name, db.company.company_symbol)),
+        ('open limit orders', db(db.limit_order.status == 'open')._select(orderby=db.limit_order.id)),
+        ('limit orders of user', db((db.limit_order.user_id == 1) & (db.limit_order.status == 'open'))._select()),
+        ('posts of topic', db(db.forum_post.topic_id == 1)._select(
+            db.forum_post.ALL, db.auth_user.first_name,
+            left=db.auth_user.on(db.auth_user.id == db.forum_post.user_id),
+            orderby=~db.forum_post.post_date|~db.forum_post.id, limitby=(0, 21))),
+        ('comments of post', db(db.forum_comment.post_id == 1)._select(
+            db.forum_comment.ALL, db.auth_user.first_name, db.reaction_comment.reaction,
+            left=[db.auth_user.on(db.auth_user.id == db.forum_comment.user_id),
+                  db.reaction_comment.on((db.reaction_comment.comment_id == db.forum_comment.id) &
+                                         (db.reaction_comment.user_id == 1))],
+            orderby=db.forum_comment.id)),
+        ('replies of comment', db(db.forum_comment.parent_idx == 1)._select()),
+        ('reaction of user', db((db.reaction_comment.comment_id == 1) & (db.reaction_comment.user_id == 1))._select()),
+        ('stock history', db((db.stock_history.company_id.belongs([1, 2]))
+                             & (db.stock_history.resolution == 60)
+                             & (db.stock_history.bucket_time >= datetime.datetime(2000, 1, 1)))._select(
+            orderby=db.stock_history.bucket_time)),
+        ('stock history prune', db((db.stock_history.resolution == 0)
+                                   & (db.stock_history.bucket_time < datetime.datetime(2000, 1, 1)))._select(
+            db.stock_history.id)),
+    ]
+
+def check_query_plans():
+    """
+    Run EXPLAIN QUERY PLAN (SQLite) on every hot query and return a list
+    of (name, plan step) for the ones that scan a table instead of
+    searching an index. An empty list means every hot query is indexed.
+    """
+    problems = []
+    for name, sql in hot_queries():
+        for row in db.executesql('EXPLAIN QUERY PLAN ' + sql):
+            detail = row[-1]
+            if detail.startswith('SCAN') and 'CONSTANT ROW' not in detail:
+                problems.append((name, detail))
+    return problems
+
+# Duplicate reactions were deleted, clear the counters of the comments
+# so that they are recounted at startup, and likewise empty the holdings
+# ledger, rebuilt from the transactions, if duplicate holdings were
+deduplicated = create_indexes()
+if 'reaction_comment' in deduplicated:
+    db(db.forum_comment).update(likes=None, dislikes=None)
+if 'holding' in deduplicated:
+    db(db.holding).delete()
 db.commit()
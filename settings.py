@@ -14,11 +14,71 @@ APP_NAME = os.path.split(APP_FOLDER)[-1]
 # DB_FOLDER:    Sets the place where migration files will be created
 #               and is the store location for SQLite databases
 DB_FOLDER = required_folder(APP_FOLDER, "databases")
-DB_URI = "sqlite://storage.db"
-DB_POOL_SIZE = 1
+DB_URI = os.environ.get("STOCKSIM_DB_URI", "sqlite://storage.db")
+# DB_STORAGE_PROFILE: "concurrent" runs SQLite in WAL mode with the pragmas
+#               below and serves the read-only actions from a pool of reader
+#               connections, "default" keeps the SQLite defaults.
+# DB_BUSY_TIMEOUT:    Milliseconds a connection waits on a lock before failing.
+# DB_MMAP_SIZE:       Bytes of the database file mapped in memory.
+# DB_CACHE_SIZE:      KiB of page cache per connection.
+# DB_READ_POOL_SIZE:  Idle reader connections kept between requests.
+DB_STORAGE_PROFILE = os.environ.get("STOCKSIM_DB_PROFILE", "concurrent")
+DB_BUSY_TIMEOUT = 5000
+DB_MMAP_SIZE = 256 * 1024 * 1024
+DB_CACHE_SIZE = 64 * 1024
+DB_READ_POOL_SIZE = 8
+DB_POOL_SIZE = 8 if DB_STORAGE_PROFILE == "concurrent" else 1
 DB_MIGRATE = True
 DB_FAKE_MIGRATE = False  # maybe?
 
+# stock simulator settings
+# SIMULATOR_TICK:   Seconds between price updates. Prices for "now" are computed
+#                   once per tick and shared by every request. None disables ticks.
+# SIMULATOR_TICKER: Compute each tick in a background thread instead of on the
+#                   first request that needs it. STOCKSIM_TICKER=off disables it.
+# PRICE_HISTORY:    Store every tick of the ticker thread in the stock_history
+#                   table, rolled up into 1 minute, 1 hour and 1 day buckets.
+# PRICE_HISTORY_TICK_RETENTION: Seconds raw ticks are kept before only the
+#                   rollups remain.
+# COMPANY_FILE:     CSV or JSON file of the simulated companies, loaded instead
+#                   of the presets of CompanyData.py (STOCKSIM_COMPANY_FILE).
+# COMPANY_LOAD_CHUNK: Companies inserted per bulk insert when loading it.
+SIMULATOR_TICK = 1.0
+SIMULATOR_TICKER = os.environ.get("STOCKSIM_TICKER", "on") != "off"
+PRICE_HISTORY = True
+PRICE_HISTORY_TICK_RETENTION = 3600
+COMPANY_FILE = os.environ.get("STOCKSIM_COMPANY_FILE")
+COMPANY_LOAD_CHUNK = 1000
+# RESPONSE_CACHE_BUDGET: Bytes of JSON responses of load_company,
+#                   get_stock_history and search_data kept for the current tick.
+RESPONSE_CACHE_BUDGET = 16 * 1024 * 1024
+
+# order execution settings
+# ORDER_QUEUE:      Execute the buy and sell orders in one writer thread that
+#                   commits them in batches. STOCKSIM_ORDER_QUEUE=off executes
+#                   them in the request instead.
+# ORDER_BATCH_SIZE: Most orders committed in one DB transaction.
+# ORDER_TIMEOUT:    Seconds a request waits for the result of its order.
+ORDER_QUEUE = os.environ.get("STOCKSIM_ORDER_QUEUE", "on") != "off"
+ORDER_BATCH_SIZE = 100
+ORDER_TIMEOUT = 10.0
+# LEADERBOARD_SIZE: Users ranked by net worth on the leaderboard.
+LEADERBOARD_SIZE = 1000
+
+# request metrics settings
+# REQUEST_METRICS:  Time every action using the database and count its SQL
+#                   statements, shown on the admin page.
+#                   STOCKSIM_REQUEST_METRICS=off disables it.
+# REQUEST_QUERY_BUDGET: SQL statements above which a request is logged.
+REQUEST_METRICS = os.environ.get("STOCKSIM_REQUEST_METRICS", "on") != "off"
+REQUEST_QUERY_BUDGET = 50
+
+# admin settings
+# ADMIN_EMAILS: Emails of the users allowed on the admin page and its
+#               maintenance actions, STOCKSIM_ADMIN_EMAILS is a comma
+#               separated list. Nobody is allowed when it is empty.
+ADMIN_EMAILS = {e.strip().lower() for e in os.environ.get("STOCKSIM_ADMIN_EMAILS", "").split(",") if e.strip()}
+
 # location where static files are stored:
 STATIC_FOLDER = required_folder(APP_FOLDER, "static")
 
@@ -15,6 +15,8 @@ class Plotter {
          */
         // Connect to google chart script
         google.charts.load('current', {'packages':['corechart']});
+        // div_id -> {chart, table, options} of the charts drawn
+        this.charts = {};
     }
 
     // Methods
@@ -47,21 +49,9 @@ class Plotter {
         }
         // Hook the chart to the div_id element
         let chart = new google.visualization.LineChart(doc_element);
-        // Set up options
-        let first_val = data.getValue(0, 1);
-        let last_val = data.getValue(data.getNumberOfRows()-1, 1);
-        // If value has increased, plot green line, else red
-        let color = "";
-        if (last_val > first_val) {
-            color = 'green';
-        } else if (last_val === first_val) {
-            color='blue';
-        } else {
-            color='red';
-        }
         let options = {
             title: title,
-            colors: [color],
+            colors: [this.line_color(data)],
             hAxis : {
                 title: "Date (local)",
                 format: 'HH:mm:ss',
@@ -83,7 +73,46 @@ class Plotter {
                 }
             }
         }
+        this.charts[div_id] = {chart: chart, table: data, options: options};
         // Draw the chart
         chart.draw(data, options);
     }
+
+    // Appends points to the chart drawn in div_id by plot_stock_history,
+    // dropping the ones more than window_ms milliseconds older than the last
+    // point. Only the new rows are added to the data table.
+    append_stock_history(dates, hist, div_id, window_ms=null) {
+        let plot = this.charts[div_id];
+        if (plot === undefined) {
+            return this.plot_stock_history(dates, hist, div_id);
+        }
+        let data = plot.table;
+        for (let i = 0; i < hist.length; i++) {
+            data.addRow([new Date(dates[i]), hist[i]]);
+        }
+        if (window_ms !== null && data.getNumberOfRows() > 0) {
+            let start = data.getValue(data.getNumberOfRows()-1, 0) - window_ms;
+            let old = 0;
+            while (old < data.getNumberOfRows()-2 && data.getValue(old, 0) < start) {
+                old++;
+            }
+            if (old > 0) {
+                data.removeRows(0, old);
+            }
+        }
+        plot.options.colors = [this.line_color(data)];
+        plot.chart.draw(data, plot.options);
+    }
+
+    // If value has increased, plot green line, else red
+    line_color(data) {
+        let first_val = data.getValue(0, 1);
+        let last_val = data.getValue(data.getNumberOfRows()-1, 1);
+        if (last_val > first_val) {
+            return 'green';
+        } else if (last_val === first_val) {
+            return 'blue';
+        }
+        return 'red';
+    }
 }
@@ -10,6 +10,8 @@ let init = (app) => {
     // This is the Vue data.
     app.data = {
         status : "",
+        cache_stats : "",
+        request_metrics : "",
     };
 
     app.enumerate = (a) => {
@@ -19,17 +21,41 @@ let init = (app) => {
         return a;
     };
 
+    app.action_status = {
+        dump_transactions : 'Dumped transactions table',
+        rebuild_holdings : 'Rebuilt holdings ledger',
+        reconcile_reactions : 'Reconciled reaction counters',
+        clear_cache : 'Cleared response cache',
+        reset_metrics : 'Reset request metrics',
+    };
+
     app.do_action = function(action) {
         axios.post(admin_url, {
             action : action
         }).then(function(r) {
-            app.vue.status = 'Dumped transactions table'
+            app.vue.status = app.action_status[action]
+            app.load_cache_stats();
+            app.load_request_metrics();
+        });
+    };
+
+    app.load_cache_stats = function() {
+        axios.get(cache_stats_url).then(function(r) {
+            app.vue.cache_stats = JSON.stringify(r.data, null, 2);
+        });
+    };
+
+    app.load_request_metrics = function() {
+        axios.get(request_metrics_url).then(function(r) {
+            app.vue.request_metrics = JSON.stringify(r.data, null, 2);
         });
     };
 
     // This contains all the methods
     app.methods = {
         do_action : app.do_action,
+        load_cache_stats : app.load_cache_stats,
+        load_request_metrics : app.load_request_metrics,
     };
 
     // This creates the Vue instance
@@ -40,7 +66,8 @@ let init = (app) => {
     });
 
     app.init = () => {
-
+        app.load_cache_stats();
+        app.load_request_metrics();
     };
 
     // Call to the initializer
@@ -29,6 +29,8 @@ let init = (app) => {
         sell_amount: 0,
         sell_error_msg: "",
         show_sell_error: false,
+        buy_error_msg: "",
+        show_buy_error: false,
     };
 
     app.enumerate = (a) => {
@@ -38,6 +40,10 @@ let init = (app) => {
         return a;
     };
 
+    // History shown on the chart, the last five minutes
+    app.history = {dates: [], prices: []};
+    app.history_window = 5 * 60 * 1000;
+
     // Determine color of price by comparing the last history elem, with the first
     app.determine_color = function(change) {
         app.vue.is_green = change > 0;
@@ -45,7 +51,32 @@ let init = (app) => {
         app.vue.is_flat = change === 0;
     };
 
-    // Update stock prices and chart
+    // Add points to the history, recompute the change over it and
+    // append them to the chart
+    app.add_history = function(times, prices) {
+        let first_plot = app.history.dates.length === 0;
+        app.history.dates.push(...times);
+        app.history.prices.push(...prices);
+        let start = app.history.dates[app.history.dates.length-1] - app.history_window;
+        while (app.history.dates.length > 2 && app.history.dates[0] < start) {
+            app.history.dates.shift();
+            app.history.prices.shift();
+        }
+        let stock_history = app.history.prices;
+        // calculate price change and determine color of text
+        change = stock_history[stock_history.length-1] - stock_history[0];
+        app.vue.co_change = change.toFixed(2);
+        app.vue.co_pct_change = (change / stock_history[0] * 100).toFixed(2);
+        app.determine_color(change);
+        if (first_plot) {
+            plotter.plot_stock_history(app.history.dates, stock_history, "chart_div", app.vue.co_name);
+        } else {
+            plotter.append_stock_history(times, prices, "chart_div", app.history_window);
+        }
+    };
+
+    // Update stock prices and chart, only the points newer than the last
+    // one of the chart are requested
     app.refresh_quote = function() {
         axios.get(load_company_url, {
             params: {
@@ -55,28 +86,41 @@ let init = (app) => {
             app.vue.co_price = response.data.co_price.toFixed(2);
             app.vue.date = response.data.date;
         }).then(function () {
+            let dates = app.history.dates;
             axios.get(get_history_url, {
                 params: {
-                    co_symbol: app.vue.co_symbol
+                    co_symbol: app.vue.co_symbol,
+                    since: dates.length > 0 ? dates[dates.length-1] : 0,
                 }
             }).then(function (response) {
-                let stock_history = response.data.stock_history;
-                let dates = response.data.dates;
-
-                // calculate price change and determine color of text
-                change = stock_history[stock_history.length-1] - stock_history[0];
-                app.vue.co_change = change.toFixed(2);
-                app.vue.co_pct_change = (change / stock_history[0] * 100).toFixed(2);
-                app.determine_color(change);
-                plotter.plot_stock_history(dates, stock_history, "chart_div", app.vue.co_name);
+                if (response.data.times.length > 0) {
+                    app.add_history(response.data.times, response.data.stock_history);
+                }
             });
         });
     };
 
+    // Follow the quotes pushed by the server, every tick appends a point
+    // to the chart and drops the ones older than the history window.
+    app.open_quote_stream = function() {
+        let source = new EventSource(stream_quotes_url + "?co_symbol=" + encodeURIComponent(app.vue.co_symbol));
+        source.addEventListener("quote", function (event) {
+            let quote = JSON.parse(event.data);
+            app.vue.co_price = quote.co_price.toFixed(2);
+            app.vue.date = quote.date;
+            let dates = app.history.dates;
+            if (dates.length > 0 && quote.time > dates[dates.length-1]) {
+                app.add_history([quote.time], [quote.co_price]);
+            }
+        });
+    };
+
     app.show_buy_menu = function(flag) {
         app.vue.buy_menu = flag;
         if (flag === false) {
             app.vue.buy_amount = 0;
+            app.vue.buy_error_msg = "";
+            app.vue.show_buy_error = false;
         }
     };
 
@@ -89,6 +133,39 @@ let init = (app) => {
         }
     };
 
+    // Shows the result of a buy or a sell: an error in its menu, or
+    // closes the menu once the order is executed. Pending orders are
+    // polled until they are.
+    app.order_done = function(data, is_buy) {
+        app.vue.user_balance = data.balance.toFixed(2);
+        if (data.error || data.pending) {
+            let msg = data.error || "Your order is pending, waiting for it to be executed...";
+            if (is_buy) {
+                app.vue.buy_error_msg = msg;
+                app.vue.show_buy_error = true;
+            }
+            else {
+                app.vue.sell_error_msg = msg;
+                app.vue.show_sell_error = true;
+            }
+            if (data.pending) {
+                setTimeout(function() {
+                    axios.get(order_status_url, {params: {order_id: data.order_id}}).then(function (response) {
+                        app.order_done(response.data, is_buy);
+                    });
+                }, 1000);
+            }
+            return;
+        }
+        app.reset_form(is_buy);
+        if (is_buy) {
+            app.show_buy_menu(false);
+        }
+        else {
+            app.show_sell_menu(false);
+        }
+    };
+
     app.buy_shares = function() {
         // Valid buy
         if (app.vue.buy_amount * app.vue.co_price <= app.vue.user_balance) {
@@ -98,9 +175,7 @@ let init = (app) => {
                     co_id: app.vue.co_id,
                     price: app.vue.co_price,
                 }).then(function (response) {
-                    app.vue.user_balance = response.data.balance.toFixed(2);
-                    app.reset_form(true);
-                    app.show_buy_menu(false);
+                    app.order_done(response.data, true);
                 });
         }
         // Invalid buy
@@ -123,9 +198,7 @@ let init = (app) => {
                                 co_id: app.vue.co_id,
                                 price: app.vue.co_price,
                             }).then(function (response) {
-                                app.vue.user_balance = response.data.balance.toFixed(2);
-                                app.reset_form(false);
-                                app.show_sell_menu(false);
+                                app.order_done(response.data, false);
                             });
                         i = h.length;
                     }
@@ -202,8 +275,9 @@ let init = (app) => {
             app.vue.co_change = response.data.co_change.toFixed(2);
             app.vue.co_pct_change = response.data.co_pct_change.toFixed(2);
 
-            // plot graph of company history
+            // plot graph of company history, then keep it current
             google.charts.setOnLoadCallback(app.refresh_quote);
+            app.open_quote_stream();
         });
     };
 
@@ -0,0 +1,51 @@
+// This will be the object that will contain the Vue attributes
+// and be used to initialize it.
+let app = {};
+
+
+// Given an empty app object, initializes it filling its attributes,
+// creates a Vue instance, and then initializes the Vue instance.
+let init = (app) => {
+
+    // Users per page
+    app.page_size = 25;
+
+    // This is the Vue data.
+    app.data = {
+        rows : [],
+        page : 0,
+        pages : 1,
+    };
+
+    app.load_page = function(page) {
+        axios.get(get_leaderboard_url, {
+            params : {page : page, size : app.page_size}
+        }).then(function(r) {
+            app.vue.rows = r.data.rows;
+            app.vue.page = r.data.page;
+            app.vue.pages = Math.max(Math.ceil(r.data.total / r.data.size), 1);
+        });
+    };
+
+    // This contains all the methods
+    app.methods = {
+        load_page : app.load_page,
+    };
+
+    // This creates the Vue instance
+    app.vue = new Vue({
+        el: "#vue-target",
+        data: app.data,
+        methods: app.methods
+    });
+
+    app.init = () => {
+        app.load_page(0);
+    };
+
+    // Call to the initializer
+    app.init();
+};
+
+// Initialize the app object
+init(app);
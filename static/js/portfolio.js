@@ -17,6 +17,8 @@ let init = (app) => {
         filename : "No file selected",
         file_url : null,
         transactions : [],
+        transactions_cursor : null,
+        loading_transactions : false,
     };
 
     app.enumerate = (a) => {
@@ -88,11 +90,27 @@ let init = (app) => {
     };
 
     app.get_transactions = function() {
-        axios.post(get_transactions_url).then(function(r) {
-            app.vue.transactions = r.data.transactions;
+        app.vue.loading_transactions = true;
+        axios.post(get_transactions_url, {
+            cursor : app.vue.transactions_cursor
+        }).then(function(r) {
+            app.vue.transactions = app.vue.transactions.concat(r.data.transactions);
+            app.vue.transactions_cursor = r.data.next_cursor;
+            app.vue.loading_transactions = false;
+        }).catch(function (error) {
+            // Scrolling again retries the same page
+            app.vue.loading_transactions = false;
         });
     };
 
+    // Load the next page of transactions when scrolled near the bottom
+    app.on_scroll = function() {
+        let bottom = window.innerHeight + window.scrollY >= document.body.offsetHeight - 200;
+        if (bottom && app.vue.transactions_cursor && !app.vue.loading_transactions) {
+            app.get_transactions();
+        }
+    };
+
     // This contains all the methods
     app.methods = {
         get_holdings : app.get_holdings,
@@ -116,6 +134,7 @@ let init = (app) => {
         app.get_holdings();
         app.get_user_info();
         app.get_transactions();
+        window.addEventListener("scroll", app.on_scroll);
         google.charts.setOnLoadCallback(app.load_net_worth);
     };
 
@@ -10,11 +10,18 @@ let init = (app) => {
 
     // This is the Vue data.
     app.data = {
-        company_rows: [],
         search_rows: [],
         search: "",
     };
 
+    // Rows by symbol, the stream covers the first stream_rows search rows
+    app.rows_by_symbol = {};
+    app.stream_rows = 100;
+    // Number of matches asked for
+    app.search_results = 50;
+    app.quote_stream = null;
+    app.preview = {symbol: null, name: "", last_time: null};
+
     app.enumerate = (a) => {
         // This adds an _idx field to each element of the array
         let k = 0;
@@ -22,36 +29,84 @@ let init = (app) => {
         return a;
     };
 
+    // Ask the server for the best matches of the search, already priced
     app.search_company = function(){
-        app.vue.search_rows = []
-        for(let r in app.vue.company_rows){
-            let row = app.vue.company_rows[r]
-
-            if (app.fuzzy_match(row.company_name,app.vue.search) || app.fuzzy_match(row.company_symbol,app.vue.search)){
-                app.vue.search_rows.push(row);
+        let search = app.vue.search;
+        axios.get(search_data_url, {
+            params: {
+                q: search,
+                k: app.search_results,
             }
-        }
-        app.display_preview();
+        }).then(function (response) {
+            if (search !== app.vue.search) {
+                return;
+            }
+            app.set_rows(response.data.company_rows);
+            if (app.vue.search_rows.length > 0) {
+                app.display_preview();
+            }
+        });
     }
 
-    app.fuzzy_match = function(str1, str2){
-        str1 = str1.toLowerCase()
-        str2 = str2.toLowerCase()
-        return str1.includes(str2) || str2.includes(str1)
+    app.set_rows = function(rows) {
+        app.rows_by_symbol = {};
+        for (let row of rows) {
+            row.url = company_url.concat("/".concat(row.id));
+            app.rows_by_symbol[row.company_symbol] = row;
+        }
+        app.vue.search_rows = rows;
     }
-    
-    // draw a small preview of the top stock in the table
+
+    // draw a small preview of the top stock in the table, a new search
+    // with the same top stock keeps its chart, which the stream updates
     app.display_preview = function() {
-        co_name = app.vue.search_rows[0]['company_name'];
-        co_symbol = app.vue.search_rows[0]['company_symbol'];
+        let co_name = app.vue.search_rows[0]['company_name'];
+        let co_symbol = app.vue.search_rows[0]['company_symbol'];
+        if (app.preview.symbol === co_symbol && app.preview.last_time !== null) {
+            app.open_quote_stream();
+            return;
+        }
+        app.preview = {symbol: co_symbol, name: co_name, last_time: null};
         axios.get(get_history_url, {
             params: {
-                co_symbol: co_symbol
+                co_symbol: co_symbol,
+                since: 0,
             }
         }).then(function(response) {
-            let stock_history = response.data.stock_history;
-            let dates = response.data.dates;
-            plotter.plot_stock_history(dates, stock_history, "chart_div", co_name);
+            if (app.preview.symbol !== co_symbol) {
+                return;
+            }
+            let times = response.data.times;
+            app.preview.last_time = times[times.length-1];
+            plotter.plot_stock_history(times, response.data.stock_history, "chart_div", co_name);
+        });
+        app.open_quote_stream();
+    }
+
+    // Follow the quotes of the first rows of the table and of the preview,
+    // the preview chart gets a point per tick over a five minutes window.
+    app.open_quote_stream = function() {
+        if (app.quote_stream) {
+            app.quote_stream.close();
+        }
+        let symbols = app.vue.search_rows.slice(0, app.stream_rows).map((r) => r.company_symbol);
+        if (symbols.length === 0) {
+            return;
+        }
+        app.quote_stream = new EventSource(stream_quotes_url + "?co_symbol=" + encodeURIComponent(symbols.join(",")));
+        app.quote_stream.addEventListener("quote", function (event) {
+            let quote = JSON.parse(event.data);
+            let row = app.rows_by_symbol[quote.co_symbol];
+            if (row) {
+                row.current_stock_value = quote.co_price;
+            }
+            let preview = app.preview;
+            if (preview.symbol !== quote.co_symbol || preview.last_time === null
+                || quote.time <= preview.last_time) {
+                return;
+            }
+            preview.last_time = quote.time;
+            plotter.append_stock_history([quote.time], [quote.co_price], "chart_div", 5 * 60 * 1000);
         });
     }
 
@@ -68,14 +123,15 @@ let init = (app) => {
     });
 
     app.init = () => {
-        axios.get(search_data_url).then(function (response) {
-            for(let r in response.data.company_rows){
-                response.data.company_rows[r].url = company_url.concat("/".concat(response.data.company_rows[r].id));
-                app.vue.company_rows.push(response.data.company_rows[r]);
-                app.vue.search_rows.push(response.data.company_rows[r])
+        axios.get(search_data_url, {
+            params: {
+                k: app.search_results,
+            }
+        }).then(function (response) {
+            app.set_rows(response.data.company_rows);
+            if (app.vue.search_rows.length > 0) {
+                google.charts.setOnLoadCallback(app.display_preview);
             }
-
-            google.charts.setOnLoadCallback(app.display_preview);
         });
     };
 
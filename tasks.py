@@ -24,11 +24,29 @@ def my_task():
         db.rollback()
 
 
+# recompute the like and dislike counters of the forum comments
+@scheduler.task
+def reconcile_reactions():
+    from .utilities import reconcile_reaction_counts
+    try:
+        db._adapter.reconnect()
+        reconcile_reaction_counts()
+        db.commit()
+    except:
+        db.rollback()
+
+
 # run my_task very 10 seconds
+# and reconcile_reactions every hour
 scheduler.conf.beat_schedule = {
     "my_first_task": {
         "task": "apps.%s.tasks.my_task" % settings.APP_NAME,
         "schedule": 10.0,
         "args": (),
     },
+    "reconcile_reactions": {
+        "task": "apps.%s.tasks.reconcile_reactions" % settings.APP_NAME,
+        "schedule": 3600.0,
+        "args": (),
+    },
 }
@@ -0,0 +1,53 @@
+"""
+Loads the modules of the app as the package stocksim, with a common module
+holding a SQLite database, an auth without user and a logger in place of
+the py4web fixtures, so that they can be tested without running py4web.
+"""
+import logging
+import os
+import sys
+import tempfile
+import types
+import pytest
+from pydal import DAL, Field
+
+APP_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class NoAuth:
+    current_user = None
+
+    def get_user(self):
+        return {}
+
+
+package = types.ModuleType('stocksim')
+package.__path__ = [APP_FOLDER]
+sys.modules['stocksim'] = package
+
+common = types.ModuleType('stocksim.common')
+# A database file, so that the threads of the order writer see the rows
+common.db = DAL('sqlite://storage.db', folder=tempfile.mkdtemp(), pool_size=4)
+common.Field = Field
+common.auth = NoAuth()
+common.logger = logging.getLogger('stocksim')
+common.db.define_table('auth_user', Field('email'), Field('first_name'), Field('last_name'))
+sys.modules['stocksim.common'] = common
+
+from stocksim.models import db
+
+
+@pytest.fixture
+def clean_db():
+    """
+    Empties the tables the tests write to, before and after the test.
+    """
+    def clean():
+        for table in (db.reaction_comment, db.forum_comment, db.forum_post, db.forum_topic,
+                      db.limit_order, db.holding, db.transaction, db.stock_history,
+                      db.company, db.user, db.auth_user):
+            db(table).delete()
+        db.commit()
+    clean()
+    yield db
+    clean()
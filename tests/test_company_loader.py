@@ -0,0 +1,80 @@
+import json
+import pytest
+from stocksim.CompanyData import preset_companies
+from stocksim.CompanyLoader import CompanyLoader
+from stocksim.StockSimulator import StockSimulator
+
+
+@pytest.fixture
+def presets():
+    return preset_companies()
+
+
+@pytest.mark.parametrize('read_size', [1, 2, 7, 1 << 16])
+def test_json_object_read_across_blocks(tmp_path, presets, read_size):
+    path = tmp_path / 'companies.json'
+    path.write_text(json.dumps(presets, indent=1))
+    loader = CompanyLoader()
+    loader.read_size = read_size
+    assert dict(loader.read(str(path))) == presets
+
+
+@pytest.mark.parametrize('read_size', [1, 3, 5, 1 << 16])
+def test_json_list_read_across_blocks(tmp_path, read_size):
+    path = tmp_path / 'companies.json'
+    # Numbers at the end of a block may go on in the next one
+    path.write_text('[{"ticker": "A", "price": 12345.678, "change": -1},'
+                    ' {"symbol": "B", "name": "Bee \\"Co\\"", "value": 7}]')
+    loader = CompanyLoader()
+    loader.read_size = read_size
+    companies = dict(loader.read(str(path)))
+    assert companies['A']['value'] == 12345.678
+    assert companies['A']['change'] == -1.0
+    assert companies['B']['name'] == 'Bee "Co"'
+    assert companies['B']['value'] == 7.0
+
+
+def test_csv_columns_duplicates_and_generated_fields(tmp_path):
+    path = tmp_path / 'companies.csv'
+    path.write_text('Ticker,Company_Name,Price\nA,Alpha,10\nB,,\nA,Again,11\n')
+    loader = CompanyLoader()
+    companies = list(loader.read(str(path)))
+    assert [symbol for symbol, _ in companies] == ['A', 'B']
+    assert companies[0][1]['name'] == 'Alpha' and companies[0][1]['value'] == 10.0
+    # Generated from the symbol, so the same on every read
+    assert dict(loader.read(str(path)))['B'] == companies[1][1]
+    assert companies[1][1]['name']
+
+
+def test_malformed_files_are_rejected(tmp_path):
+    loader = CompanyLoader()
+    path = tmp_path / 'companies.json'
+    path.write_text('"AAPL"')
+    with pytest.raises(ValueError):
+        list(loader.read(str(path)))
+    path.write_text('[{"symbol": "A"}, {"name": "No symbol"}]')
+    with pytest.raises(ValueError):
+        list(loader.read(str(path)))
+    path.write_text('[{"symbol": "A"}')
+    with pytest.raises(ValueError):
+        list(loader.read(str(path)))
+
+
+def test_seed_streams_the_file_and_leaves_the_same_companies_as_load(tmp_path, clean_db, presets):
+    db = clean_db
+    path = tmp_path / 'companies.json'
+    path.write_text(json.dumps(presets))
+    simulator = StockSimulator(1.0)
+    simulator.initialize_database(dict(presets, EXTRA=dict(name='Extra', value=1.0, change=0.0)))
+    db.commit()
+    loader = CompanyLoader()
+    assert simulator.seed_database(loader.read(str(path)), 3) == 1
+    assert sorted(r.company_symbol for r in db(db.company).select()) == sorted(presets)
+    assert simulator.seed_database(loader.read(str(path)), 3) == 0
+    ids = {r.company_symbol: r.id for r in db(db.company).select()}
+    presets['AAPL'] = dict(presets['AAPL'], value=1.5)
+    path.write_text(json.dumps(presets))
+    assert simulator.seed_database(loader.read(str(path)), 3) == 1
+    rows = db(db.company).select()
+    assert {r.company_symbol: r.id for r in rows} == ids
+    assert [r.current_stock_value for r in rows if r.company_symbol == 'AAPL'] == [1.5]
@@ -0,0 +1,33 @@
+import pytest
+from stocksim.models import create_indexes, db
+
+
+def test_duplicate_companies_are_not_deleted(clean_db):
+    db.executesql('DROP INDEX company_symbol_idx;')
+    try:
+        first = db.company.insert(company_name='Alpha', company_symbol='ALP')
+        db.company.insert(company_name='Alpha again', company_symbol='ALP')
+        user_id = db.auth_user.insert(email='trader@example.com')
+        db.holding.insert(user_id=user_id, company_id=first, shares=3)
+        with pytest.raises(RuntimeError, match='company_symbol_idx'):
+            create_indexes()
+        assert db(db.company).count() == 2
+        assert db(db.holding.company_id == first).count() == 1
+    finally:
+        db.rollback()
+        db(db.holding).delete()
+        db(db.company).delete()
+        create_indexes()
+        db.commit()
+
+
+def test_duplicate_reactions_keep_the_latest(clean_db):
+    db.executesql('DROP INDEX reaction_comment_comment_user_uidx;')
+    user_id = db.auth_user.insert(email='reader@example.com')
+    topic_id = db.forum_topic.insert(topic='Markets')
+    post_id = db.forum_post.insert(user_id=user_id, topic_id=topic_id, post_title='Buy?', post_content='...')
+    comment_id = db.forum_comment.insert(user_id=user_id, post_id=post_id, comment='Yes')
+    db.reaction_comment.insert(comment_id=comment_id, user_id=user_id, reaction=1)
+    latest = db.reaction_comment.insert(comment_id=comment_id, user_id=user_id, reaction=-1)
+    assert create_indexes() == ['reaction_comment']
+    assert db(db.reaction_comment).select(db.reaction_comment.id).column() == [latest]
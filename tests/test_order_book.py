@@ -0,0 +1,93 @@
+from stocksim.OrderBook import MatchingEngine, OrderBook
+from stocksim.OrderQueue import OrderQueue
+
+
+def taken_ids(fills):
+    return [fill[0] for fill in fills]
+
+
+def test_fills_by_price_then_time():
+    book = OrderBook()
+    book.add(1, 10, 'buy', 1, 100.0)
+    book.add(2, 11, 'buy', 1, 101.0)
+    book.add(3, 12, 'buy', 1, 100.0)
+    book.add(4, 13, 'buy', 1, 99.0)
+    book.add(5, 14, 'sell', 1, 120.0)
+    book.add(6, 15, 'sell', 1, 118.0)
+    book.add(7, 16, 'sell', 1, 118.0)
+    assert taken_ids(book.fills(100.0)) == [2, 1, 3]
+    assert taken_ids(book.fills(119.0)) == [6, 7]
+    assert sorted(book.orders) == [4, 5]
+
+
+def test_orders_the_price_does_not_reach_stay():
+    book = OrderBook()
+    book.add(1, 10, 'buy', 5, 90.0)
+    book.add(2, 11, 'sell', 5, 110.0)
+    assert book.fills(100.0) == []
+    assert len(book) == 2
+    assert book.fills(90.0) == [(1, 10, 'buy', 5, 90.0, 0)]
+    assert len(book) == 1
+
+
+def test_cancelled_orders_are_skipped():
+    book = OrderBook()
+    for order_id in range(100):
+        book.add(order_id, 10, 'buy', 1, 100.0)
+    for order_id in range(0, 100, 2):
+        assert book.cancel(order_id)
+    assert not book.cancel(0)
+    assert taken_ids(book.fills(100.0)) == list(range(1, 100, 2))
+
+
+def test_order_added_back_keeps_its_place():
+    book = OrderBook()
+    book.add(1, 10, 'buy', 1, 101.0)
+    book.add(2, 11, 'buy', 1, 100.0)
+    [first] = book.fills(101.0)
+    book.add(3, 12, 'buy', 1, 101.0)
+    book.add(*first[:5], seq=first[5])
+    assert taken_ids(book.fills(100.0)) == [1, 3, 2]
+
+
+class HeldQueue:
+    """
+    Order queue that keeps the orders until they are released.
+    """
+    def __init__(self, error = None):
+        self.queued = []
+        # Error of the orders executed as soon as they are queued
+        self.error = error
+
+    def enqueue(self, order):
+        self.queued.append(order)
+        if self.error is not None:
+            self.release(self.error)
+        return order
+
+    def release(self, error = None):
+        for order in self.queued:
+            order.error = error
+            order.done.set()
+        self.queued = []
+
+
+def test_match_does_not_wait_for_the_queue():
+    orders = HeldQueue()
+    engine = MatchingEngine(orders, timeout=0.01)
+    engine.book(7).add(1, 10, 'buy', 2, 100.0)
+    assert engine.match({7: 99.0}) == 0
+    assert len(engine.in_flight) == 1
+    orders.release()
+    assert engine.match({}) == 1
+    assert engine.in_flight == []
+
+
+def test_fills_of_a_failed_batch_go_back_to_their_place():
+    engine = MatchingEngine(HeldQueue(OrderQueue.failed))
+    book = engine.book(7)
+    book.add(1, 10, 'buy', 2, 100.0)
+    book.add(2, 11, 'buy', 2, 100.0)
+    assert engine.match({7: 100.0}) == 0
+    book.add(3, 12, 'buy', 2, 100.0)
+    assert taken_ids(book.fills(100.0)) == [1, 2, 3]
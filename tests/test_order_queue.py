@@ -0,0 +1,83 @@
+import pytest
+from stocksim.OrderQueue import OrderQueue
+
+
+@pytest.fixture
+def market(clean_db):
+    db = clean_db
+    company_id = db.company.insert(company_name='Alpha', company_symbol='ALP', current_stock_value=10.0)
+    user_id = db.auth_user.insert(email='trader@example.com')
+    db.user.insert(user_id=user_id, user_balance=100.0)
+    db.commit()
+    return db, user_id, company_id
+
+
+def balance(db, user_id):
+    return db(db.user.user_id == user_id).select(db.user.user_balance).first().user_balance
+
+
+def shares(db, user_id, company_id):
+    row = db((db.holding.user_id == user_id) & (db.holding.company_id == company_id)).select().first()
+    return row.shares if row else 0
+
+
+def test_orders_are_checked_and_applied(market):
+    db, user_id, company_id = market
+    orders = OrderQueue()
+    orders.start()
+    try:
+        assert orders.submit(user_id, company_id, 'buy', 4, 10.0) == dict(balance=60.0)
+        with pytest.raises(ValueError, match='Insufficient balance'):
+            orders.submit(user_id, company_id, 'buy', 7, 10.0)
+        with pytest.raises(ValueError):
+            orders.submit(user_id, company_id, 'sell', 5, 10.0)
+        assert orders.submit(user_id, company_id, 'sell', 1, 12.0) == dict(balance=72.0)
+    finally:
+        orders.stop()
+    assert balance(db, user_id) == 72.0
+    assert shares(db, user_id, company_id) == 3
+
+
+def test_failed_batch_is_rolled_back_and_can_be_retried(market, monkeypatch):
+    db, user_id, company_id = market
+    orders = OrderQueue()
+    execute = orders.execute
+    failing = [True]
+
+    def execute_or_fail(order):
+        execute(order)
+        if failing[0]:
+            raise RuntimeError('disk full')
+    monkeypatch.setattr(orders, 'execute', execute_or_fail)
+    orders.start()
+    try:
+        with pytest.raises(ValueError, match=OrderQueue.failed):
+            orders.submit(user_id, company_id, 'buy', 2, 10.0)
+        assert balance(db, user_id) == 100.0
+        assert shares(db, user_id, company_id) == 0
+        assert db(db.transaction).isempty()
+        failing[0] = False
+        assert orders.submit(user_id, company_id, 'buy', 2, 10.0) == dict(balance=80.0)
+    finally:
+        orders.stop()
+    assert shares(db, user_id, company_id) == 2
+    assert db(db.transaction).count() == 1
+
+
+def test_orders_still_queued_are_left_pending(market):
+    db, user_id, company_id = market
+    orders = OrderQueue(timeout=0.01)
+    # Orders are queued for a writer that has not started yet
+    orders.writer = object()
+    result = orders.submit(user_id, company_id, 'buy', 1, 10.0)
+    assert result == dict(pending=True, order_id=result['order_id'])
+    assert orders.poll(user_id, result['order_id']) == result
+    assert orders.poll(user_id + 1, result['order_id']) is None
+    orders.writer = None
+    orders.start()
+    try:
+        orders.pending[result['order_id']][0].done.wait(5)
+    finally:
+        orders.stop()
+    assert orders.poll(user_id, result['order_id']) == dict(balance=90.0)
+    assert orders.poll(user_id, result['order_id']) is None
@@ -0,0 +1,65 @@
+import datetime
+import types
+import numpy as np
+from stocksim.PriceHistory import PriceHistory
+
+
+def at(minute, second):
+    return datetime.datetime(2026, 1, 1, 12, minute, second)
+
+
+def companies(db, version):
+    ids = np.array([r.id for r in db(db.company).select(orderby=db.company.id)], dtype=np.int64)
+    return types.SimpleNamespace(version=version, ids=ids)
+
+
+def tick(history, state, time, prices):
+    quotes = types.SimpleNamespace(version=state.version, companies=state, time=time,
+                                   prices=np.array(prices, dtype=float))
+    history.record(types.SimpleNamespace(version=state.version), quotes)
+
+
+def bar(db, company_id, resolution, time):
+    row = db((db.stock_history.company_id == company_id) & (db.stock_history.resolution == resolution)
+             & (db.stock_history.bucket_time == time)).select().first()
+    return (row.open_value, row.high_value, row.low_value, row.close_value)
+
+
+def test_open_buckets_survive_a_restart(clean_db):
+    db = clean_db
+    a = db.company.insert(company_name='Alpha', company_symbol='A', current_stock_value=10)
+    b = db.company.insert(company_name='Beta', company_symbol='B', current_stock_value=20)
+    state = companies(db, 1)
+    history = PriceHistory(10.0)
+    tick(history, state, at(0, 10), [10, 20])
+    tick(history, state, at(0, 20), [14, 18])
+    tick(history, state, at(1, 0), [12, 19])
+    history = PriceHistory(10.0)
+    tick(history, state, at(1, 30), [9, 21])
+    tick(history, state, at(2, 0), [11, 22])
+    assert bar(db, a, 60, at(0, 0)) == (10, 14, 10, 14)
+    assert bar(db, a, 60, at(1, 0)) == (12, 12, 9, 9)
+    history = PriceHistory(10.0)
+    tick(history, state, at(2, 10), [13, 23])
+    assert [float(v[0]) for v in history.buckets[3600][1:]] == [10, 14, 9, 13]
+    assert [float(v[1]) for v in history.buckets[3600][1:]] == [20, 23, 18, 23]
+
+
+def test_reseed_restarts_only_the_rewritten_companies(clean_db):
+    db = clean_db
+    a = db.company.insert(company_name='Alpha', company_symbol='A', current_stock_value=10)
+    b = db.company.insert(company_name='Beta', company_symbol='B', current_stock_value=20)
+    state = companies(db, 1)
+    history = PriceHistory(10.0)
+    tick(history, state, at(0, 10), [10, 20])
+    tick(history, state, at(0, 20), [15, 25])
+    # Beta is rewritten and Gamma added: their history is gone
+    db(db.stock_history.company_id == b).delete()
+    c = db.company.insert(company_name='Gamma', company_symbol='C', current_stock_value=30)
+    history.reset()
+    state = companies(db, 2)
+    tick(history, state, at(0, 30), [12, 5, 30])
+    tick(history, state, at(1, 0), [11, 6, 31])
+    assert bar(db, a, 60, at(0, 0)) == (10, 15, 10, 12)
+    assert bar(db, b, 60, at(0, 0)) == (5, 5, 5, 5)
+    assert bar(db, c, 60, at(0, 0)) == (30, 30, 30, 30)
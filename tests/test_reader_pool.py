@@ -0,0 +1,43 @@
+import pytest
+from py4web import DAL, Session, action
+from py4web.core import request, response
+from py4web.utils.auth import Auth
+from py4web.utils.dbstore import DBStore
+from stocksim.ReaderPool import ReaderPool, apply_pragmas
+
+
+@pytest.fixture
+def app_db(tmp_path):
+    db = DAL('sqlite://storage.db', folder=str(tmp_path), pool_size=2,
+             after_connection=lambda adapter: apply_pragmas(adapter.connection, ['journal_mode=WAL']))
+    yield db
+    db.close()
+
+
+def get(path):
+    request.setup({'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '',
+                   'HTTP_HOST': 'localhost', 'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+                   'wsgi.url_scheme': 'http'})
+    request.app_name = 'stocksim'
+    response.__init__()
+
+
+def test_reader_action_saves_the_session_in_db(app_db):
+    db = app_db
+    session = Session(secret='Xy9!kLmN0pQrStUvWz12345678-test-secret', storage=DBStore(db))
+    auth = Auth(session, db, define_tables=True)
+    db_reader = ReaderPool(db, 2, session=session)
+    connections = []
+
+    @action.uses(db_reader, auth)
+    def count_users():
+        connections.append(db._adapter.connection)
+        with pytest.raises(Exception, match='readonly'):
+            db.auth_user.insert(email='reader@example.com')
+        return db(db.auth_user).count()
+
+    get('/stocksim/count_users')
+    assert count_users() == 0
+    # Auth changed the session, saved on the writer connection afterwards
+    assert db(db.py4web_session).count() == 1
+    assert connections[0] is not db._adapter.connection
@@ -0,0 +1,71 @@
+import types
+import pytest
+from stocksim.SearchIndex import SearchIndex
+
+
+class Registry:
+    """
+    Stands in for CompanyRegistry, holding the companies in memory.
+    """
+    def __init__(self, companies):
+        self.state = None
+        self.set(companies)
+
+    def set(self, companies):
+        version = self.state.version + 1 if self.state else 1
+        self.state = types.SimpleNamespace(version=version, symbols=[symbol for symbol, _ in companies],
+                                           names=[name for _, name in companies])
+
+    def current(self):
+        return self.state
+
+
+COMPANIES = [
+    ('AAPL', 'Apple Inc.'),
+    ('MSFT', 'Microsoft Corporation'),
+    ('AMZN', 'Amazon.com Inc.'),
+    ('APP', 'AppLovin Corporation'),
+    ('MCHP', 'Microchip Technology'),
+    ('GOOGL', 'Alphabet Inc.'),
+]
+
+
+@pytest.fixture
+def index():
+    return SearchIndex(Registry(COMPANIES))
+
+
+def found(index, query, k = 20):
+    return [index.registry.state.symbols[i] for i in index.search(query, k)]
+
+
+def test_exact_symbol_comes_first(index):
+    assert found(index, 'app')[0] == 'APP'
+    assert found(index, 'AAPL') == ['AAPL']
+
+
+def test_prefixes_of_symbols_before_names_and_words(index):
+    assert found(index, 'ap') == ['APP', 'AAPL']
+    assert found(index, 'micro') == ['MCHP', 'MSFT']
+    assert found(index, 'chip') == ['MCHP']
+
+
+def test_typos_match_by_trigrams(index):
+    assert found(index, 'micrsoft')[0] == 'MSFT'
+    assert found(index, 'amazn inc')[0] == 'AMZN'
+    assert found(index, 'xyzzy') == []
+
+
+def test_ties_go_to_the_shorter_name(index):
+    assert found(index, 'inc') == ['AAPL', 'GOOGL', 'AMZN']
+
+
+def test_top_k_and_empty_query(index):
+    assert found(index, 'corporation', 1) == ['APP']
+    assert found(index, '  ', 3) == ['AAPL', 'MSFT', 'AMZN']
+
+
+def test_rebuilt_when_the_companies_change(index):
+    assert found(index, 'nvda') == []
+    index.registry.set(COMPANIES + [('NVDA', 'NVIDIA Corporation')])
+    assert found(index, 'nvda') == ['NVDA']
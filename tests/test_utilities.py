@@ -0,0 +1,24 @@
+from stocksim.models import db
+from stocksim.utilities import save_comment_reaction
+
+
+def counts(comment_id):
+    comment = db.forum_comment[comment_id]
+    return comment.likes, comment.dislikes
+
+
+def test_reaction_changes_move_the_counters(clean_db):
+    user_id = db.auth_user.insert(email='reader@example.com')
+    other_id = db.auth_user.insert(email='other@example.com')
+    topic_id = db.forum_topic.insert(topic='Markets')
+    post_id = db.forum_post.insert(user_id=user_id, topic_id=topic_id, post_title='Buy?', post_content='...')
+    comment_id = db.forum_comment.insert(user_id=user_id, post_id=post_id, comment='Yes', likes=0, dislikes=0)
+    save_comment_reaction(comment_id, user_id, 1)
+    save_comment_reaction(comment_id, user_id, 1)
+    save_comment_reaction(comment_id, other_id, 1)
+    assert counts(comment_id) == (2, 0)
+    save_comment_reaction(comment_id, user_id, -1)
+    assert counts(comment_id) == (1, 1)
+    save_comment_reaction(comment_id, other_id, 0)
+    assert counts(comment_id) == (0, 1)
+    assert db(db.reaction_comment).count() == 2
@@ -4,36 +4,114 @@ This way we don't have to clutter the controllers.py file with function
 declarations that are unrelated to hooking pages to URLs
 """
 import datetime
+import math
+import numpy as np
 
 from .StockSimulator import StockSimulator
 from .common import db
 
 def get_portfolio(user_id:int, sim) -> dict:
-    transactions = db(db.transaction.user_id == user_id).select(orderby=db.transaction.transaction_date)
+    rows = db(db.holding.user_id == user_id).select()
     holdings = {}
     spent, gained = 0.0, 0.0
-    for row in transactions:
-        if row.transaction_type == 'buy':
-            if row.company_id not in holdings:
-                holdings[row.company_id] = 0.0
-            holdings[row.company_id] += row.count
-            spent += row.count * row.value_per_share
-        else:
-            if row.company_id not in holdings:
-                raise KeyError('Attempted to sell a stock the user does not own')
-            if row.count > holdings[row.company_id]:
-                raise ValueError(f'Cannot sell {row.count} shares, user owns {holdings[row.company_id]}')
-            holdings[row.company_id] -= row.count
-            if holdings[row.company_id] == 0:
-                del holdings[row.company_id]
-            gained += row.count * row.value_per_share
+    for row in rows:
+        if row.shares > 0:
+            holdings[row.company_id] = row.shares
+        spent += row.bought_value
+        gained += row.sold_value
     value = gained - spent
-    for k, v in holdings.items():
-        company = db(db.company.id == k).select().first()
-        share_val = sim.load_company(company.company_symbol)['current_stock_value']
-        value += v * share_val
+    prices = sim.current_prices(list(holdings))
+    value += sum(v * p for v, p in zip(holdings.values(), prices))
     return {'holdings' : holdings, 'spent' : spent, 'gained' : gained, 'value' : value}
 
+def get_holding_rows(user_id, sim):
+    """
+    Returns the open positions of a user with the company name and symbol,
+    the current price and the average bought price, from one joined query
+    and one batch pricing of all the companies.
+    """
+    query = ((db.holding.user_id == user_id) & (db.holding.shares > 0)
+             & (db.holding.company_id == db.company.id))
+    rows = db(query).select(
+        db.holding.company_id, db.holding.shares, db.holding.cost_basis,
+        db.company.company_name, db.company.company_symbol,
+        orderby=db.company.company_symbol)
+    prices = sim.current_prices([r.holding.company_id for r in rows])
+    return [{'company_name' : r.company.company_name,
+             'company_id' : r.holding.company_id,
+             'symbol' : r.company.company_symbol,
+             'shares' : r.holding.shares,
+             'price' : round(float(p), 2),
+             'bought_price' : round(r.holding.cost_basis / r.holding.shares, 2)} for r, p in zip(rows, prices)]
+
+def apply_trade(holding, transaction_type, count, value_per_share):
+    """
+    Update a holding (a dictionary with the fields of the holding table)
+    with a buy or a sell, using average cost for the cost basis.
+    """
+    total = count * value_per_share
+    if transaction_type == 'buy':
+        holding['shares'] += count
+        holding['cost_basis'] += total
+        holding['bought_value'] += total
+    else:
+        if count > holding['shares']:
+            raise ValueError(f'Cannot sell {count} shares, user owns {holding["shares"]}')
+        avg_cost = holding['cost_basis'] / holding['shares'] if holding['shares'] else 0.0
+        holding['realized_pnl'] += total - count * avg_cost
+        holding['shares'] -= count
+        holding['cost_basis'] = 0.0 if holding['shares'] == 0 else holding['cost_basis'] - count * avg_cost
+        holding['sold_value'] += total
+    return holding
+
+def record_trade(user_id, company_id, transaction_type, count, value_per_share):
+    """
+    Insert a transaction and apply it to the user's holdings ledger.
+    Both happen in the current DB transaction. Returns the updated
+    holding. Raises ValueError, before writing anything, unless count and
+    value_per_share are finite and positive.
+    """
+    count, value_per_share = float(count), float(value_per_share)
+    if not (math.isfinite(count) and count > 0):
+        raise ValueError(f'Invalid number of shares {count}')
+    if not (math.isfinite(value_per_share) and value_per_share > 0):
+        raise ValueError(f'Invalid price {value_per_share}')
+    query = (db.holding.user_id == user_id) & (db.holding.company_id == company_id)
+    row = db(query).select().first()
+    holding = row.as_dict() if row else dict(
+        user_id=user_id, company_id=company_id, shares=0.0, cost_basis=0.0,
+        realized_pnl=0.0, bought_value=0.0, sold_value=0.0)
+    apply_trade(holding, transaction_type, count, value_per_share)
+    db.transaction.insert(
+        company_id=company_id,
+        user_id=user_id,
+        transaction_type=transaction_type,
+        count=count,
+        value_per_share=value_per_share,
+    )
+    if row:
+        row.update_record(**{k: holding[k] for k in ('shares', 'cost_basis', 'realized_pnl', 'bought_value', 'sold_value')})
+    else:
+        db.holding.insert(**holding)
+    return holding
+
+def rebuild_holdings(user_id = None):
+    """
+    Regenerate the holdings ledger of a user, or of every user if
+    user_id is None, by replaying the transaction log.
+    """
+    query = db.transaction.id > 0 if user_id is None else db.transaction.user_id == user_id
+    db(db.holding.id > 0 if user_id is None else db.holding.user_id == user_id).delete()
+    holdings = {}
+    for row in db(query).select(orderby=db.transaction.transaction_date|db.transaction.id):
+        key = (row.user_id, row.company_id)
+        if key not in holdings:
+            holdings[key] = dict(user_id=row.user_id, company_id=row.company_id, shares=0.0,
+                                 cost_basis=0.0, realized_pnl=0.0, bought_value=0.0, sold_value=0.0)
+        apply_trade(holdings[key], row.transaction_type, row.count, row.value_per_share)
+    db.holding.bulk_insert(list(holdings.values()))
+    return len(holdings)
+
 # Function to get user balance, might be useful when computing the total
 # value of the user's holdings using functions similar to ones below.
 def get_user_balance(user_id = None):
@@ -46,60 +124,137 @@ def get_user_balance(user_id = None):
         return None
     return user.user_balance
 
-def get_avg_bought_price(user_id, company_id):
-    query = (db.transaction.company_id == company_id) & (db.transaction.user_id == user_id)
-    sum, count = 0, 0
-    for r in db(query).select():
-        count += r.count
-        sum += r.count * r.value_per_share
-    return sum / count
+def get_post_comments(post_id, user_id):
+    """
+    Returns the top level comments of a post sorted by likes - dislikes,
+    each with its author, reaction counts, the reaction of the given
+    user, and its replies in reply_list.
+    Runs one query whatever the number of comments.
+    """
+    # Comments with their owner and the reaction of the current user
+    viewer_reaction = db.reaction_comment.on(
+        (db.reaction_comment.comment_id == db.forum_comment.id) &
+        (db.reaction_comment.user_id == user_id))
+    rows = db(db.forum_comment.post_id == post_id).select(
+        db.forum_comment.ALL, db.auth_user.first_name, db.auth_user.last_name,
+        db.auth_user.email, db.reaction_comment.reaction,
+        left=[db.auth_user.on(db.auth_user.id == db.forum_comment.user_id), viewer_reaction],
+        orderby=db.forum_comment.id)
+
+    # If a comment has a parent, add it to the reply dict
+    # otherwise, it is a top level comment
+    comments = []
+    reply_dict = {}
+    for r in rows:
+        c = r.forum_comment.as_dict()
+        user = r.auth_user
+        c['user_name'] = "unknown" if user.email is None else user.first_name + " " + user.last_name
+        c['user_email'] = user.email
+        c['reaction'] = r.reaction_comment.reaction or 0
+        if c['parent_idx'] == -1:
+            comments.append(c)
+        else:
+            reply_dict.setdefault(c['parent_idx'], []).append(c)
+
+    # Connect the replies to the comments
+    for c in comments:
+        c['reply_list'] = reply_dict.get(c['id'], [])
+
+    # Sort comments by likes-dislikes
+    comments.sort(key=lambda c: c['likes'] - c['dislikes'], reverse=True)
+    return comments
+
+def save_comment_reaction(comment_id, user_id, reaction):
+    """
+    Insert or update the reaction of a user to a comment, and adjust the
+    likes and dislikes counters of the comment by the change of reaction.
+    A user has at most one reaction per comment (a unique index). The
+    reaction is only replaced if it is still the one read, so that the
+    change is counted once when concurrent requests race; the loser reads
+    it again and retries.
+    """
+    query = (db.reaction_comment.comment_id == comment_id) & (db.reaction_comment.user_id == user_id)
+    while True:
+        old = db(query).select(db.reaction_comment.reaction).first()
+        if old is None:
+            try:
+                db.reaction_comment.insert(comment_id=comment_id, user_id=user_id, reaction=reaction)
+            except db._adapter.driver.IntegrityError:
+                continue
+            old_reaction = 0
+            break
+        old_reaction = old.reaction
+        if old_reaction == reaction:
+            return
+        if db(query & (db.reaction_comment.reaction == old_reaction)).update(reaction=reaction) == 1:
+            break
+    likes = int(reaction == 1) - int(old_reaction == 1)
+    dislikes = int(reaction == -1) - int(old_reaction == -1)
+    if likes or dislikes:
+        db(db.forum_comment.id == comment_id).update(
+            likes=db.forum_comment.likes + likes,
+            dislikes=db.forum_comment.dislikes + dislikes,
+        )
+
+def reconcile_reaction_counts():
+    """
+    Recompute the likes and dislikes counters of every comment from
+    reaction_comment. Returns the number of comments that were off.
+    """
+    count = db.reaction_comment.id.count()
+    rows = db(db.reaction_comment.reaction.belongs([1, -1])).select(
+        db.reaction_comment.comment_id, db.reaction_comment.reaction, count,
+        groupby=db.reaction_comment.comment_id | db.reaction_comment.reaction)
+    counts = {}
+    for r in rows:
+        c = counts.setdefault(r.reaction_comment.comment_id, [0, 0])
+        c[0 if r.reaction_comment.reaction == 1 else 1] = r[count]
+    fixed = 0
+    for c in db(db.forum_comment).select(db.forum_comment.id, db.forum_comment.likes, db.forum_comment.dislikes):
+        likes, dislikes = counts.get(c.id, (0, 0))
+        if c.likes != likes or c.dislikes != dislikes:
+            db(db.forum_comment.id == c.id).update(likes=likes, dislikes=dislikes)
+            fixed += 1
+    return fixed
 
 def get_net_worth_history(user_id, sim, time=None, steps=30):
+    """
+    Returns the net worth of the user at steps evenly spaced times from
+    time (by default five minutes ago) to now, and those times.
+    The holdings at every step form a (steps x companies) matrix that is
+    multiplied with the price matrix of the same companies.
+    """
+    now = datetime.datetime.utcnow()
     if time is None:
-        time = datetime.datetime.utcnow() - datetime.timedelta(minutes=5)
-    
-    def interval():
-        delta = datetime.datetime.utcnow() - time
-        delta /= steps - 1
-        for i in range(steps):
-            yield time + (delta * i)
-    
-    history = []
-    dates = []
-    holdings = {}
-    balance = 100000
-    transactions = db(db.transaction.user_id == user_id).select(orderby=db.transaction.transaction_date)
-    transactions = transactions.as_list()
-    pos = 0
-
-    def advance_transactions(t):
-        nonlocal pos, balance
-        while pos < len(transactions) and (row := transactions[pos])['transaction_date'] < t:
-            pos += 1
-            if row['transaction_type'] == 'buy':
-                if row['company_id'] not in holdings:
-                    holdings[row['company_id']] = 0.0
-                holdings[row['company_id']] += row['count']
-                balance -= row['count'] * row['value_per_share']
-            else:
-                if row['company_id'] not in holdings:
-                    raise KeyError('Attempted to sell a stock the user does not own')
-                if row['count'] > holdings[row['company_id']]:
-                    raise ValueError(f'Cannot sell {row["count"]} shares, user owns {holdings[row["company_id"]]}')
-                holdings[row['company_id']] -= row['count']
-                balance += row['count'] * row['value_per_share']
-
-    advance_transactions(time)
-
-    for timestep in interval():
-        advance_transactions(timestep)
-        net_worth = balance
-        for k,v in holdings.items():
-            price = sim.load_company(k, timestep)['current_stock_value']
-            net_worth += price * v
-        history.append(net_worth)
-        dates.append(timestep)
-    
-    return history, dates
-    
-    
\ No newline at end of file
+        time = now - datetime.timedelta(minutes=5)
+    steps = max(steps, 2)
+    delta = (now - time) / (steps - 1)
+    dates = [time + delta * i for i in range(steps)]
+
+    transactions = db(db.transaction.user_id == user_id).select(
+        db.transaction.company_id, db.transaction.transaction_type, db.transaction.count,
+        db.transaction.value_per_share, db.transaction.transaction_date,
+        orderby=db.transaction.transaction_date)
+    company_ids = list(dict.fromkeys(int(r.company_id) for r in transactions))
+    column = {c: j for j, c in enumerate(company_ids)}
+
+    # A transaction counts from the first step strictly after its date,
+    # row steps of the change matrices collects those after the last step.
+    offsets = np.array([(d - time).total_seconds() for d in dates])
+    made = np.array([(r.transaction_date - time).total_seconds() for r in transactions])
+    step = np.searchsorted(offsets, made, side='right')
+    sign = np.array([1.0 if r.transaction_type == 'buy' else -1.0 for r in transactions])
+    count = np.array([r.count for r in transactions], dtype=float)
+    cost = count * np.array([r.value_per_share for r in transactions], dtype=float)
+    shares = np.zeros((steps + 1, len(company_ids)))
+    np.add.at(shares, (step, [column[int(r.company_id)] for r in transactions]), sign * count)
+    cash = np.zeros(steps + 1)
+    np.add.at(cash, step, -sign * cost)
+    shares = np.cumsum(shares, axis=0)[:steps]
+    balance = 100000 + np.cumsum(cash)[:steps]
+
+    state = sim.registry.current()
+    idx = [state.index(c) for c in company_ids]
+    prices = sim.price_matrix(idx, dates, state)
+    history = balance + np.einsum('tc,ct->t', shares, prices)
+    return history.tolist(), dates